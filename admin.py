@@ -480,6 +480,7 @@ class AdminManager:
                 "is_banned": True,
                 "ban_reason": reason,
                 "ban_until": ban_until.isoformat(),
+                "ban_until_ts": ban_until.timestamp(),
                 "banned_by": admin_id,
                 "banned_at": datetime.now().isoformat()
             })
@@ -490,6 +491,7 @@ class AdminManager:
         elif action == "unban":
             self.db.update_user(target_id, {
                 "is_banned": False,
+                "ban_until_ts": None,
                 "unbanned_by": admin_id,
                 "unbanned_at": datetime.now().isoformat()
             })
@@ -518,10 +520,12 @@ class AdminManager:
             
             if warnings >= 3:
                 # Auto ban for 3 warnings
+                ban_until = datetime.now() + timedelta(hours=24)
                 self.db.update_user(target_id, {
                     "is_banned": True,
                     "ban_reason": f"Auto-ban: {warnings} warnings",
-                    "ban_until": (datetime.now() + timedelta(hours=24)).isoformat()
+                    "ban_until": ban_until.isoformat(),
+                    "ban_until_ts": ban_until.timestamp()
                 })
                 message = f"⚠️ সতর্কতা #{warnings} দেওয়া হয়েছে এবং অটো-ব্যান করা হয়েছে। কারণ: {reason}"
                 action_type = "user_auto_banned"
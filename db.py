@@ -1,8 +1,10 @@
 import json
 import os
+from bisect import bisect_left, insort
 import shutil
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, Optional, List, Set
 import threading
 import pickle
 
@@ -33,6 +35,18 @@ class Database:
         # Lock for thread safety
         self.lock = threading.Lock()
         
+        # Callbacks run after a user is created/updated: (user_id, updates)
+        self.update_listeners = []
+        # Callbacks run after restore_backup replaces the stored data
+        self.restore_listeners = []
+        
+        # Activity index: day -> ids of users last active that day, plus
+        # the bucket days kept sorted for range queries
+        self._active_by_day: Dict[date, Set[int]] = defaultdict(set)
+        self._active_days: List[date] = []
+        self._user_active_day: Dict[int, date] = {}
+        self._build_activity_index()
+        
         print("✅ Advanced Database v15.0.00 Initialized")
     
     def _load_data(self, name: str, default=None):
@@ -65,6 +79,17 @@ class Database:
             print(f"❌ Error saving {name}: {e}")
             return False
     
+    def _save_raw(self, name: str, payload: bytes):
+        """Save data that is already pickled"""
+        path = os.path.join(self.data_dir, f"{name}.pkl")
+        try:
+            with open(path, 'wb') as f:
+                f.write(payload)
+            return True
+        except Exception as e:
+            print(f"❌ Error saving {name}: {e}")
+            return False
+    
     def _default_shop(self):
         """Default shop items"""
         return {
@@ -140,11 +165,91 @@ class Database:
     
     # =============== USER MANAGEMENT ===============
     
+    def add_update_listener(self, callback):
+        """Register a callback for user creates/updates"""
+        self.update_listeners.append(callback)
+    
+    def add_restore_listener(self, callback):
+        """Register a callback for backup restores"""
+        self.restore_listeners.append(callback)
+    
+    def _notify_restore_listeners(self):
+        """Run restore callbacks so derived indexes can be rebuilt"""
+        for callback in self.restore_listeners:
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠️ Restore listener failed: {e}")
+    
+    def _notify_update_listeners(self, user_id: int, updates: Dict):
+        """Run user update callbacks (outside the lock)"""
+        for callback in self.update_listeners:
+            try:
+                callback(user_id, updates)
+            except Exception as e:
+                print(f"⚠️ User update listener failed: {e}")
+    
+    def _build_activity_index(self):
+        """Build the last-active index from loaded users"""
+        self._active_by_day.clear()
+        self._active_days.clear()
+        self._user_active_day.clear()
+        for user in self.users.values():
+            self._index_activity(user.get("id"), user.get("last_active"))
+    
+    def _index_activity(self, user_id: int, timestamp: Optional[str]):
+        """Move a user into the bucket of its last-active day"""
+        try:
+            day = date.fromisoformat(timestamp[:10])
+        except (TypeError, ValueError):
+            day = date(2000, 1, 1)
+        
+        previous_day = self._user_active_day.get(user_id)
+        if previous_day == day:
+            return
+        
+        if previous_day is not None:
+            bucket = self._active_by_day[previous_day]
+            bucket.discard(user_id)
+            if not bucket:
+                del self._active_by_day[previous_day]
+                del self._active_days[bisect_left(self._active_days, previous_day)]
+        
+        if day not in self._active_by_day:
+            insort(self._active_days, day)
+        self._active_by_day[day].add(user_id)
+        self._user_active_day[user_id] = day
+    
+    def active_user_ids(self, days: int = 7) -> Set[int]:
+        """Ids of users active within the last `days` days (by day)"""
+        cutoff_day = date.today() - timedelta(days=days)
+        with self.lock:
+            start = bisect_left(self._active_days, cutoff_day)
+            return set().union(*(self._active_by_day[day] for day in self._active_days[start:]))
+    
+    def inactive_user_ids(self, days: int) -> Set[int]:
+        """Ids of users not active within the last `days` days (by day)"""
+        cutoff_day = date.today() - timedelta(days=days)
+        with self.lock:
+            end = bisect_left(self._active_days, cutoff_day)
+            return set().union(*(self._active_by_day[day] for day in self._active_days[:end]))
+    
     def get_user(self, user_id: int) -> Optional[Dict]:
         """Get user data with caching"""
         with self.lock:
             return self.users.get(str(user_id))
     
+    def get_users_bulk(self, user_ids: List[int]) -> Dict[int, Dict]:
+        """Get several users under one lock, keyed by the ids asked for"""
+        with self.lock:
+            users = self.users
+            found = {}
+            for user_id in user_ids:
+                user = users.get(str(user_id))
+                if user is not None:
+                    found[user_id] = user
+            return found
+    
     def create_user(self, user_id: int, user_info: Dict) -> Dict:
         """Create new user with advanced profile"""
         with self.lock:
@@ -162,6 +267,7 @@ class Database:
                 "coins": Config.WELCOME_BONUS,
                 "total_earned": 0,
                 "total_spent": 0,
+                "has_deposited": False,
                 
                 # Level System
                 "level": 1,
@@ -225,26 +331,32 @@ class Database:
             
             self.users[str(user_id)] = user_data
             self._save_data("users", self.users)
+            self._index_activity(user_id, timestamp)
             
             # Update global stats
             self.stats["total_users"] = len(self.users)
             self._save_data("stats", self.stats)
-            
-            return user_data
+        
+        self._notify_update_listeners(user_id, user_data)
+        return user_data
     
     def update_user(self, user_id: int, updates: Dict) -> bool:
         """Update user data with timestamp"""
         with self.lock:
             user_id_str = str(user_id)
-            if user_id_str in self.users:
-                # Add timestamp
-                updates["last_active"] = datetime.now().isoformat()
-                
-                # Update user
-                self.users[user_id_str].update(updates)
-                self._save_data("users", self.users)
-                return True
-            return False
+            if user_id_str not in self.users:
+                return False
+            
+            # Add timestamp
+            updates["last_active"] = datetime.now().isoformat()
+            
+            # Update user
+            self.users[user_id_str].update(updates)
+            self._save_data("users", self.users)
+            self._index_activity(self.users[user_id_str].get("id", user_id), updates["last_active"])
+        
+        self._notify_update_listeners(user_id, updates)
+        return True
     
     def get_all_users(self, active_only: bool = False) -> List[Dict]:
         """Get all users"""
@@ -421,6 +533,7 @@ class Database:
             
             # Restore data
             self.users = backup_data.get("users", {})
+            self._build_activity_index()
             self.payments = backup_data.get("payments", {})
             self.shop = backup_data.get("shop", self._default_shop())
             self.games = backup_data.get("games", {})
@@ -438,6 +551,7 @@ class Database:
             # Cleanup
             shutil.rmtree(temp_dir)
             
+            self._notify_restore_listeners()
             return True
         except Exception as e:
             print(f"❌ Restore failed: {e}")
@@ -517,10 +631,45 @@ class Database:
             self._save_data("logs", self.logs)
             
             # Keep only last 1000 logs
-            if len(self.logs) > 1000:
-                # Sort by timestamp and remove oldest
-                sorted_logs = sorted(self.logs.items(), 
-                                   key=lambda x: x[1].get("timestamp", ""))
-                for i in range(len(sorted_logs) - 1000):
-                    del self.logs[sorted_logs[i][0]]
-                self._save_data("logs", self.logs)
\ No newline at end of file
+            if self._trim_logs():
+                self._save_data("logs", self.logs)
+    
+    def add_logs_batch(self, entries: List[tuple]):
+        """Add several system logs with a single save
+        
+        entries: (log_type, message, user_id, data) tuples
+        """
+        if not entries:
+            return
+        
+        with self.lock:
+            now = datetime.now()
+            log_prefix = f"log_{now.strftime('%Y%m%d_%H%M%S_%f')}"
+            timestamp = now.isoformat()
+            
+            for i, (log_type, message, user_id, data) in enumerate(entries):
+                log_id = f"{log_prefix}_{i}"
+                self.logs[log_id] = {
+                    "id": log_id,
+                    "type": log_type,
+                    "message": message,
+                    "user_id": user_id,
+                    "timestamp": timestamp,
+                    "data": data or {}
+                }
+            
+            # Keep only last 1000 logs
+            self._trim_logs()
+            self._save_data("logs", self.logs)
+    
+    def _trim_logs(self) -> bool:
+        """Remove oldest logs beyond the last 1000"""
+        if len(self.logs) <= 1000:
+            return False
+        
+        # Sort by timestamp and remove oldest
+        sorted_logs = sorted(self.logs.items(), 
+                           key=lambda x: x[1].get("timestamp", ""))
+        for i in range(len(sorted_logs) - 1000):
+            del self.logs[sorted_logs[i][0]]
+        return True
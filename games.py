@@ -16,6 +16,9 @@ class GamesManager:
         self.active_games = {}
         self.game_history = {}
         
+        # Callbacks run after a game is added to game_history: (game_id, game_data)
+        self.game_listeners = []
+        
         # Game configurations
         self.game_configs = {
             "dice": {
@@ -128,6 +131,19 @@ class GamesManager:
             ]
         }
     
+    def add_game_listener(self, callback):
+        """Register a callback for games added to game_history"""
+        self.game_listeners.append(callback)
+    
+    def _record_history(self, history_key: str, game_data: Dict):
+        """Add a finished game to game_history and run game listeners"""
+        self.game_history[history_key] = game_data
+        for callback in self.game_listeners:
+            try:
+                callback(history_key, game_data)
+            except Exception as e:
+                print(f"⚠️ Game listener failed: {e}")
+    
     async def play_dice(self, user_id: int, bet: int, auto_roll: bool = False) -> Dict:
         """Play dice game with advanced features"""
         # Validate bet
@@ -243,21 +259,23 @@ class GamesManager:
         self.db.update_game_stats(user_id, "dice", game_result)
         
         # Add to game history
-        history_key = f"{user_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        self.game_history[history_key] = {
+        now = datetime.now()
+        history_key = f"{user_id}_{now.strftime('%Y%m%d%H%M%S')}"
+        self._record_history(history_key, {
             "user_id": user_id,
             "game": "dice",
             "result": result,
             "bet": bet,
             "payout": payout,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": now.isoformat(),
+            "ts_epoch": int(now.timestamp()),
             "details": {
                 "user_roll": user_roll,
                 "bot_roll": bot_roll,
                 "win_chance": win_chance,
                 "house_edge": house_edge
             }
-        }
+        })
         
         return {
             "success": True,
@@ -388,21 +406,23 @@ class GamesManager:
         self.db.update_game_stats(user_id, "slot", game_result)
         
         # Add to history
-        history_key = f"{user_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        self.game_history[history_key] = {
+        now = datetime.now()
+        history_key = f"{user_id}_{now.strftime('%Y%m%d%H%M%S')}"
+        self._record_history(history_key, {
             "user_id": user_id,
             "game": "slot",
             "result": result_type,
             "bet": bet,
             "payout": payout,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": now.isoformat(),
+            "ts_epoch": int(now.timestamp()),
             "details": {
                 "slots": slot_result,
                 "win_chance": win_chance,
                 "jackpot_chance": jackpot_chance,
                 "house_edge": house_edge
             }
-        }
+        })
         
         return {
             "success": True,
@@ -645,14 +665,16 @@ class GamesManager:
         del self.active_games[quiz_id]
         
         # Add to history
-        history_key = f"{user_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        self.game_history[history_key] = {
+        now = datetime.now()
+        history_key = f"{user_id}_{now.strftime('%Y%m%d%H%M%S')}"
+        self._record_history(history_key, {
             "user_id": user_id,
             "game": "quiz",
             "result": result,
             "entry_fee": quiz_data["entry_fee"],
             "payout": reward,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": now.isoformat(),
+            "ts_epoch": int(now.timestamp()),
             "details": {
                 "question": quiz_data["question"],
                 "user_answer": answer_number - 1,
@@ -661,7 +683,7 @@ class GamesManager:
                 "category": quiz_data["category"],
                 "difficulty": quiz_data["difficulty"]
             }
-        }
+        })
         
         return {
             "success": True,
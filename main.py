@@ -8,6 +8,7 @@ Main Entry Point for Termux/CLI
 import os
 import sys
 import time
+import asyncio
 import threading
 from datetime import datetime
 
@@ -215,6 +216,15 @@ def run_option(option):
     else:
         print("❌ Invalid option!")
 
+def _report_notifier_start(future):
+    """Log an exception raised while starting the notifier"""
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        print(f"❌ Notifier failed to start: {error}")
+        Logger.log_error("NotifierStartError", str(error))
+
 def start_bot():
     """Start the Telegram bot"""
     print("\n🚀 Starting MARPD Bot...")
@@ -258,9 +268,14 @@ def start_bot():
         # Start background services
         print("🚀 Starting background services...")
         backup_manager.start()
-        notifier.start()
         scheduler.start()
         
+        # Notifier runs its scheduler and batching on its own event loop
+        notifier_loop = asyncio.new_event_loop()
+        threading.Thread(target=notifier_loop.run_forever, daemon=True).start()
+        notifier_future = asyncio.run_coroutine_threadsafe(notifier.start(), notifier_loop)
+        notifier_future.add_done_callback(_report_notifier_start)
+        
         # Create and start bot
         print("🤖 Creating bot instance...")
         bot = MARPD_Bot(db)
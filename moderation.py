@@ -1,10 +1,22 @@
 import re
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict, namedtuple
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 from config import Config
 from db import Database
 from utils import Utils
 
+# Warning reason details (name, points, duration)
+ReasonDetail = namedtuple("ReasonDetail", "name points duration")
+
+# Moderation actions
+ALLOW, BAN, MUTE, WARN, DELETE, NONE, PERMANENT_BAN = (
+    "ALLOW", "BAN", "MUTE", "WARN", "DELETE", "NONE", "PERMANENT_BAN"
+)
+_DURATION_ACTIONS = frozenset({MUTE, BAN})
+
 class Moderation:
     """Advanced Chat Moderation System v15.0.00"""
     
@@ -13,41 +25,13 @@ class Moderation:
         self.config = Config()
         self.moderation_logs = []
         self.warn_reasons = {
-            "spam": {
-                "name": "স্প্যাম মেসেজ",
-                "points": 10,
-                "duration": "1 hour mute"
-            },
-            "bad_words": {
-                "name": "অপমানজনক ভাষা",
-                "points": 15,
-                "duration": "3 hour mute"
-            },
-            "links": {
-                "name": "অনুমোদনহীন লিংক",
-                "points": 20,
-                "duration": "6 hour mute"
-            },
-            "harassment": {
-                "name": "হ্যারাসমেন্ট",
-                "points": 25,
-                "duration": "12 hour mute"
-            },
-            "scam": {
-                "name": "স্ক্যাম প্রচেষ্টা",
-                "points": 30,
-                "duration": "24 hour ban"
-            },
-            "impersonation": {
-                "name": "অন্যের পরিচয় নেওয়া",
-                "points": 40,
-                "duration": "Permanent ban"
-            },
-            "other": {
-                "name": "অন্যান্য",
-                "points": 5,
-                "duration": "Warning"
-            }
+            "spam": ReasonDetail("স্প্যাম মেসেজ", 10, "1 hour mute"),
+            "bad_words": ReasonDetail("অপমানজনক ভাষা", 15, "3 hour mute"),
+            "links": ReasonDetail("অনুমোদনহীন লিংক", 20, "6 hour mute"),
+            "harassment": ReasonDetail("হ্যারাসমেন্ট", 25, "12 hour mute"),
+            "scam": ReasonDetail("স্ক্যাম প্রচেষ্টা", 30, "24 hour ban"),
+            "impersonation": ReasonDetail("অন্যের পরিচয় নেওয়া", 40, "Permanent ban"),
+            "other": ReasonDetail("অন্যান্য", 5, "Warning")
         }
         
         # Auto-moderation rules
@@ -55,6 +39,10 @@ class Moderation:
             "spam_detection": {
                 "enabled": True,
                 "max_messages_per_minute": 10,
+                "phrases": [
+                    "click here", "free money", "make money fast",
+                    "work from home", "earn daily", "get rich"
+                ],
                 "action": "mute_5_minutes"
             },
             "link_protection": {
@@ -75,8 +63,20 @@ class Moderation:
             }
         }
         
+        # Repeated characters + spam phrases, compiled once
+        self._spam_re = re.compile(
+            r'(.)\1{5,}|(?i:' + '|'.join(
+                map(re.escape, self.auto_mod_rules["spam_detection"]["phrases"])
+            ) + ')'
+        )
+        
         # Load moderation data
         self.moderation_data = self._load_moderation_data()
+        
+        # Reports by status: sorted (created_at, index in reports) pairs
+        self._reports_by_status: Dict[str, List[Tuple[str, int]]] = defaultdict(list)
+        for index, report in enumerate(self.moderation_data["reports"]):
+            insort(self._reports_by_status[report["status"]], (report.get("created_at", ""), index))
     
     def _load_moderation_data(self) -> Dict:
         """Load moderation data"""
@@ -133,22 +133,22 @@ class Moderation:
                 points += 5
         
         # Determine final action
-        final_action = "ALLOW"
+        final_action = ALLOW
         if points >= 30:
-            final_action = "BAN"
+            final_action = BAN
             duration = "24h"
         elif points >= 20:
-            final_action = "MUTE"
+            final_action = MUTE
             duration = "6h"
         elif points >= 15:
-            final_action = "MUTE"
+            final_action = MUTE
             duration = "1h"
         elif points >= 10:
-            final_action = "WARN"
+            final_action = WARN
         elif points >= 5:
-            final_action = "DELETE"
+            final_action = DELETE
         
-        if final_action != "ALLOW":
+        if final_action != ALLOW:
             self.moderation_data["auto_mod_stats"]["actions_taken"] += 1
             
             # Log auto-moderation action
@@ -157,7 +157,7 @@ class Moderation:
                 user_id,
                 {
                     "action": final_action,
-                    "duration": duration if final_action in ["MUTE", "BAN"] else None,
+                    "duration": duration if final_action in _DURATION_ACTIONS else None,
                     "points": points,
                     "violations": violations,
                     "message_preview": message[:50]
@@ -168,8 +168,8 @@ class Moderation:
             "action": final_action,
             "points": points,
             "violations": violations,
-            "duration": duration if final_action in ["MUTE", "BAN"] else None,
-            "message": "Message approved" if final_action == "ALLOW" else f"Auto-mod: {', '.join(violations)}"
+            "duration": duration if final_action in _DURATION_ACTIONS else None,
+            "message": "Message approved" if final_action == ALLOW else f"Auto-mod: {', '.join(violations)}"
         }
     
     async def _check_spam(self, user_id: int, message: str, chat_type: str) -> Dict:
@@ -183,24 +183,12 @@ class Moderation:
             is_spam = True
             action = self.auto_mod_rules["spam_detection"]["action"]
         
-        # Check for excessive repetition
-        if re.search(r'(.)\1{5,}', message):  # 6 or more repeated characters
+        # Check for excessive repetition (6 or more repeated characters)
+        # and common spam phrases in a single pass
+        if self._spam_re.search(message):
             is_spam = True
             action = self.auto_mod_rules["spam_detection"]["action"]
         
-        # Check for common spam phrases
-        spam_phrases = [
-            "click here", "free money", "make money fast",
-            "work from home", "earn daily", "get rich"
-        ]
-        
-        message_lower = message.lower()
-        for phrase in spam_phrases:
-            if phrase in message_lower:
-                is_spam = True
-                action = self.auto_mod_rules["spam_detection"]["action"]
-                break
-        
         return {
             "is_spam": is_spam,
             "action": action
@@ -281,8 +269,8 @@ class Moderation:
             }
         
         # Get warning reason details
-        reason_details = self.warn_reasons.get(reason, self.warn_reasons["other"])
-        warning_points = points or reason_details["points"]
+        reason_details = self.warn_reasons.get(reason) or self.warn_reasons["other"]
+        warning_points = points or reason_details.points
         
         # Get current warning points
         current_points = user.get("warning_points", 0)
@@ -295,7 +283,7 @@ class Moderation:
         warning_entry = {
             "id": f"warn_{datetime.now().strftime('%Y%m%d%H%M%S')}",
             "reason": reason,
-            "reason_text": reason_details["name"],
+            "reason_text": reason_details.name,
             "points": warning_points,
             "warned_by": warned_by,
             "notes": notes,
@@ -332,9 +320,9 @@ class Moderation:
             }
         )
         
-        message = f"⚠️ {user_id} কে সতর্কতা দেওয়া হয়েছে। কারণ: {reason_details['name']} ({warning_points} পয়েন্ট)"
+        message = f"⚠️ {user_id} কে সতর্কতা দেওয়া হয়েছে। কারণ: {reason_details.name} ({warning_points} পয়েন্ট)"
         
-        if auto_action["action"] != "NONE":
+        if auto_action["action"] != NONE:
             message += f"\n⚡ অটো-একশন: {auto_action['message']}"
         
         return {
@@ -356,7 +344,7 @@ class Moderation:
                 0   # Permanent
             )
             return {
-                "action": "PERMANENT_BAN",
+                "action": PERMANENT_BAN,
                 "message": "স্থায়ী ব্যান",
                 "duration": "Permanent"
             }
@@ -370,7 +358,7 @@ class Moderation:
                 168  # 7 days in hours
             )
             return {
-                "action": "BAN",
+                "action": BAN,
                 "message": "৭ দিনের ব্যান",
                 "duration": "7 days"
             }
@@ -384,7 +372,7 @@ class Moderation:
                 72  # 3 days in hours
             )
             return {
-                "action": "BAN",
+                "action": BAN,
                 "message": "৩ দিনের ব্যান",
                 "duration": "3 days"
             }
@@ -398,7 +386,7 @@ class Moderation:
                 24  # 1 day in hours
             )
             return {
-                "action": "MUTE",
+                "action": MUTE,
                 "message": "১ দিনের মিউট",
                 "duration": "1 day"
             }
@@ -412,13 +400,13 @@ class Moderation:
                 6  # 6 hours
             )
             return {
-                "action": "MUTE",
+                "action": MUTE,
                 "message": "৬ ঘন্টার মিউট",
                 "duration": "6 hours"
             }
         
         return {
-            "action": "NONE",
+            "action": NONE,
             "message": "কোনো অটো-একশন নেই",
             "duration": None
         }
@@ -450,8 +438,10 @@ class Moderation:
         
         if ban_until:
             user["ban_until"] = ban_until.isoformat()
+            user["ban_until_ts"] = ban_until.timestamp()
         else:
             user["ban_until"] = None
+            user["ban_until_ts"] = None
         
         # Add to ban history
         ban_history = user.get("ban_history", [])
@@ -475,6 +465,7 @@ class Moderation:
             "banned_by": banned_by,
             "banned_at": user["banned_at"],
             "ban_until": user["ban_until"],
+            "ban_until_ts": user["ban_until_ts"],
             "ban_history": ban_history
         })
         
@@ -518,6 +509,7 @@ class Moderation:
         
         # Update user
         user["is_banned"] = False
+        user["ban_until_ts"] = None
         user["unbanned_by"] = unbanned_by
         user["unban_reason"] = reason
         user["unbanned_at"] = datetime.now().isoformat()
@@ -529,6 +521,7 @@ class Moderation:
         
         self.db.update_user(user_id, {
             "is_banned": False,
+            "ban_until_ts": None,
             "unbanned_by": unbanned_by,
             "unban_reason": reason,
             "unbanned_at": user["unbanned_at"],
@@ -574,6 +567,7 @@ class Moderation:
         user["muted_by"] = muted_by
         user["muted_at"] = datetime.now().isoformat()
         user["mute_until"] = mute_until.isoformat()
+        user["mute_until_ts"] = mute_until.timestamp()
         user["mute_duration"] = duration_minutes
         
         self.db.update_user(user_id, {
@@ -582,6 +576,7 @@ class Moderation:
             "muted_by": muted_by,
             "muted_at": user["muted_at"],
             "mute_until": user["mute_until"],
+            "mute_until_ts": user["mute_until_ts"],
             "mute_duration": duration_minutes
         })
         
@@ -626,32 +621,39 @@ class Moderation:
         
         # Check if ban has expired
         if status["banned"]:
-            ban_until = user.get("ban_until")
-            if ban_until:
-                try:
-                    ban_end = datetime.fromisoformat(ban_until)
-                    if datetime.now() > ban_end:
-                        # Auto unban
-                        await self.unban_user(user_id, 0, "Auto-unban: Ban expired")
-                        status["banned"] = False
-                except:
-                    pass
+            ban_end = self._expiry_timestamp(user, "ban_until")
+            if ban_end is not None and time.time() > ban_end:
+                # Auto unban
+                await self.unban_user(user_id, 0, "Auto-unban: Ban expired")
+                status["banned"] = False
         
         # Check if mute has expired
         if status["muted"]:
-            mute_until = user.get("mute_until")
-            if mute_until:
-                try:
-                    mute_end = datetime.fromisoformat(mute_until)
-                    if datetime.now() > mute_end:
-                        # Auto unmute
-                        self.db.update_user(user_id, {"is_muted": False})
-                        status["muted"] = False
-                except:
-                    pass
+            mute_end = self._expiry_timestamp(user, "mute_until")
+            if mute_end is not None and time.time() > mute_end:
+                # Auto unmute
+                self.db.update_user(user_id, {"is_muted": False, "mute_until_ts": None})
+                status["muted"] = False
         
         return status
     
+    def _expiry_timestamp(self, user: Dict, field: str) -> Optional[float]:
+        """Get ban/mute expiry as epoch seconds (None if never expires)"""
+        expiry_ts = user.get(f"{field}_ts")
+        if expiry_ts is not None:
+            return expiry_ts
+        
+        # Records written before epoch timestamps were stored
+        expiry = user.get(field)
+        if not expiry:
+            return None
+        try:
+            expiry_ts = datetime.fromisoformat(expiry).timestamp()
+        except (TypeError, ValueError):
+            return None
+        user[f"{field}_ts"] = expiry_ts
+        return expiry_ts
+    
     async def clear_warnings(self, user_id: int, cleared_by: int, 
                            reason: str = "Good behavior") -> Dict:
         """Clear all warnings for a user"""
@@ -774,12 +776,12 @@ class Moderation:
                 total_warning_points += points
         
         # Recent moderation actions
+        # ISO-8601 timestamps sort lexicographically, so compare as strings
         recent_actions = []
-        cutoff = datetime.now() - timedelta(days=7)
+        cutoff_iso = (datetime.now() - timedelta(days=7)).isoformat()
         
         for log in self.moderation_logs:
-            timestamp = datetime.fromisoformat(log.get("timestamp", "2000-01-01"))
-            if timestamp > cutoff:
+            if log.get("timestamp", "") > cutoff_iso:
                 recent_actions.append(log)
         
         action_types = {}
@@ -830,6 +832,10 @@ class Moderation:
         }
         
         self.moderation_data["reports"].append(queue_entry)
+        insort(
+            self._reports_by_status[queue_entry["status"]],
+            (queue_entry["created_at"], len(self.moderation_data["reports"]) - 1)
+        )
         
         # Log the report
         self._log_moderation_action(
@@ -917,12 +923,20 @@ class Moderation:
         if not result["success"]:
             return result
         
+        # Move report to its new status index
+        index_key = (report.get("created_at", ""), report_index)
+        old_status_reports = self._reports_by_status[report["status"]]
+        del old_status_reports[bisect_left(old_status_reports, index_key)]
+        insort(self._reports_by_status[status], index_key)
+        
         # Update report status
-        self.moderation_data["reports"][report_index]["status"] = status
-        self.moderation_data["reports"][report_index]["processed_by"] = admin_id
-        self.moderation_data["reports"][report_index]["processed_at"] = datetime.now().isoformat()
-        self.moderation_data["reports"][report_index]["action_taken"] = action
-        self.moderation_data["reports"][report_index]["notes"] = notes
+        report.update(
+            status=status,
+            processed_by=admin_id,
+            processed_at=datetime.now().isoformat(),
+            action_taken=action,
+            notes=notes
+        )
         
         # Log the processing
         self._log_moderation_action(
@@ -947,14 +961,6 @@ class Moderation:
         }
     
     async def get_moderation_queue(self, status: str = "PENDING") -> List[Dict]:
-        """Get moderation queue items"""
-        queue_items = []
-        
-        for report in self.moderation_data["reports"]:
-            if report["status"] == status:
-                queue_items.append(report)
-        
-        # Sort by creation time (oldest first)
-        queue_items.sort(key=lambda x: x.get("created_at", ""))
-        
-        return queue_items
\ No newline at end of file
+        """Get moderation queue items (oldest first)"""
+        reports = self.moderation_data["reports"]
+        return [reports[index] for _, index in self._reports_by_status.get(status, ())]
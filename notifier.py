@@ -1,14 +1,30 @@
 import asyncio
-import schedule
 import time
-import threading
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Set
+import aiohttp
+from collections import Counter, defaultdict, deque
+from datetime import date, datetime, timedelta
+from itertools import islice
+from typing import Deque, Dict, List, Optional, Set, Tuple
 from config import Config
 from db import Database
 from utils import Utils
 from logger import Logger
 
+class _TemplateData(dict):
+    """Template data that leaves unknown placeholders as-is"""
+    
+    def __missing__(self, key):
+        return '{' + key + '}'
+
+
+class _RetryAfter(Exception):
+    """Telegram asked us to slow down (HTTP 429)"""
+    
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limited, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
 class Notifier:
     """Advanced Notification System v15.0.00"""
     
@@ -25,7 +41,13 @@ class Notifier:
             'default_language': 'bn',
             'notification_channels': ['telegram', 'in_app'],
             'emergency_contacts': [self.config.BOT_OWNER_ID],
-            'auto_cleanup_days': 7
+            'auto_cleanup_days': 7,
+            'bulk_concurrency': 50,
+            'batch_max': 50,
+            'flush_interval_seconds': 3,
+            'log_batch_max': 100,
+            'log_flush_interval_seconds': 1,
+            'simulate_delay_seconds': 0
         }
         
         # Notification templates
@@ -68,13 +90,92 @@ class Notifier:
             }
         }
         
+        # Admins + owner + emergency contacts, see refresh_admin_ids()
+        self._admin_ids: List[int] = []
+        self.refresh_admin_ids()
+        
+        # (type, language) -> template, with English fallback filled in
+        self._template_index = self._build_template_index()
+        
         # Notification queue
         self.notification_queue = []
-        self.sent_notifications = []
-        self.user_notification_history = {}
+        # Kept in send order; maxlen drops the oldest entries
+        self.sent_notifications: Deque[Dict] = deque(maxlen=1000)
+        self.user_notification_history: Dict[int, Deque[Dict]] = defaultdict(lambda: deque(maxlen=100))
+        
+        # Last send time (epoch) per (user_id, notification_type)
+        self._last_sent: Dict[Tuple[int, str], float] = {}
+        
+        # Monotonic send times per user for the hourly sliding window
+        self._hourly_sent: Dict[int, Deque[float]] = defaultdict(deque)
+        
+        # Running counters over sent_notifications for get_notification_stats
+        self._sent_by_type: Counter = Counter()
+        self._sent_by_status: Counter = Counter()
+        self._sent_recent: Deque[float] = deque(maxlen=1000)
+        
+        # Notification id sequence
+        self._seq = 0
+        
+        # Pending db.add_log entries: (log_type, message, user_id, data)
+        self._log_batch: List[Tuple] = []
+        
+        # Background tasks (created by start())
+        self._flush_task: Optional[asyncio.Task] = None
+        self._log_flush_task: Optional[asyncio.Task] = None
+        
+        # Shared keep-alive HTTP session for Telegram sends (created by start())
+        self._http: Optional[aiohttp.ClientSession] = None
+        
+        # Monotonic time until which Telegram sends are paused (after a 429)
+        self._send_paused_until = 0.0
+        self._scheduler_task: Optional[asyncio.Task] = None
+        self._scheduled_jobs = []
+        
+        # Users who claimed the daily bonus on _daily_claimed_date
+        self._daily_claimed_today: Set[int] = set()
+        self._daily_claimed_date = date.today()
+        
+        self._load_daily_claims()
+        self.db.add_update_listener(self._on_user_update)
         
         self.logger.info("🔔 Notifier v15.0.00 Initialized")
     
+    def _build_template_index(self) -> Dict[Tuple[str, str], str]:
+        """Flatten templates for single-lookup access"""
+        index = {}
+        for notification_type, templates in self.templates.items():
+            for language in ('bn', 'en'):
+                template = templates.get(language) or templates.get('en')
+                if template:
+                    index[(notification_type, language)] = template
+        return index
+    
+    def _load_daily_claims(self):
+        """Load today's daily bonus claims from the database once"""
+        today = self._daily_claimed_date.isoformat()
+        
+        for user in self.db.users.values():
+            if user.get('last_daily') == today:
+                self._daily_claimed_today.add(user['id'])
+    
+    def _on_user_update(self, user_id: int, updates: Dict):
+        """Database update listener feeding on_daily_claim"""
+        if updates.get('last_daily') == date.today().isoformat():
+            self.on_daily_claim(user_id)
+    
+    def on_daily_claim(self, user_id: int):
+        """Record a daily bonus claim"""
+        self._get_daily_claimed_today().add(user_id)
+    
+    def _get_daily_claimed_today(self) -> Set[int]:
+        """Get today's daily claims, resetting on date rollover"""
+        today = date.today()
+        if today != self._daily_claimed_date:
+            self._daily_claimed_today = set()
+            self._daily_claimed_date = today
+        return self._daily_claimed_today
+    
     async def send_notification(self, user_id: int, notification_type: str, 
                                data: Dict = None, priority: str = 'normal') -> Dict:
         """Send notification to user"""
@@ -83,6 +184,15 @@ class Notifier:
             if not self.settings['enabled']:
                 return {'success': False, 'message': 'Notifications are disabled'}
             
+            # Check notification cooldown (before the user fetch, so
+            # throttled sends cost only a dict lookup)
+            if not await self._check_cooldown(user_id, notification_type):
+                return {'success': False, 'message': 'Notification cooldown active'}
+            
+            # Check hourly limit
+            if not await self._check_hourly_limit(user_id):
+                return {'success': False, 'message': 'Hourly notification limit reached'}
+            
             # Get user
             user = self.db.get_user(user_id)
             if not user:
@@ -93,61 +203,59 @@ class Notifier:
             if not user_settings.get('notifications', True):
                 return {'success': False, 'message': 'User has disabled notifications'}
             
-            # Check notification cooldown
-            if not await self._check_cooldown(user_id, notification_type):
-                return {'success': False, 'message': 'Notification cooldown active'}
-            
-            # Check hourly limit
-            if not await self._check_hourly_limit(user_id):
-                return {'success': False, 'message': 'Hourly notification limit reached'}
-            
             # Get user language
             language = user_settings.get('language', self.settings['default_language'])
             if language not in ['bn', 'en']:
                 language = self.settings['default_language']
             
-            # Prepare notification data
-            notification_data = data or {}
+            # Prepare notification data (copied, bulk sends share `data`)
+            notification_data = dict(data) if data else {}
             notification_data['name'] = user.get('first_name', 'User')
             
-            # Get template
-            template = self.templates.get(notification_type, {}).get(language)
-            if not template:
-                # Fallback to English or default
-                template = self.templates.get(notification_type, {}).get('en')
-                if not template:
-                    template = 'Notification: {type}'
-            
-            # Format message
-            try:
-                message = template.format(**notification_data)
-            except KeyError as e:
+            # Get template and format message
+            template = self._template_index.get((notification_type, language))
+            if template:
+                message = template.format_map(_TemplateData(notification_data))
+            else:
                 message = f"Notification: {notification_type}"
-                self.logger.warning(f"Missing key in notification template: {e}")
             
-            # Create notification object
-            notification_id = f"notif_{datetime.now().strftime('%Y%m%d%H%M%S')}_{user_id}"
+            # Create notification object ('ts' is epoch seconds for
+            # comparisons, 'timestamp' is kept for display)
+            now = time.time()
+            self._seq += 1
+            notification_id = f"notif_{self._seq}_{user_id}"
             notification = {
                 'id': notification_id,
                 'user_id': user_id,
                 'type': notification_type,
                 'message': message,
                 'priority': priority,
-                'timestamp': datetime.now().isoformat(),
+                'ts': now,
+                'timestamp': datetime.fromtimestamp(now).isoformat(),
                 'status': 'PENDING',
                 'data': notification_data,
                 'language': language,
                 'channels': self.settings['notification_channels']
             }
             
-            # Add to queue
-            self.notification_queue.append(notification)
-            
-            # Log notification
-            self.logger.info(f"Notification queued: {notification_type} for user {user_id}")
+            if self._flush_task is not None:
+                # Batched: the flush loop sends it with the next batch and
+                # records it in the user's history once it is SENT/FAILED
+                self.notification_queue.append(notification)
+                self.logger.info(f"Notification queued: {notification_type} for user {user_id}")
+                
+                return {
+                    'success': True,
+                    'message': 'Notification queued',
+                    'notification_id': notification_id,
+                    'notification': notification
+                }
             
             # Process notification (in real implementation, this would send via Telegram)
             await self._process_notification(notification)
+            if notification['status'] == 'PENDING':
+                # Rate limited: retried by the flush loop once started
+                self.notification_queue.insert(0, notification)
             
             # Update user notification history
             self._update_user_history(user_id, notification)
@@ -168,32 +276,38 @@ class Notifier:
         try:
             # Mark as sending
             notification['status'] = 'SENDING'
-            notification['sent_at'] = datetime.now().isoformat()
-            
-            # In a real implementation, this would send via Telegram API
-            # For now, we'll simulate sending
+            notification['sent_at'] = time.time()
             
             user_id = notification['user_id']
             message = notification['message']
             
-            # Simulate sending delay
-            await asyncio.sleep(0.1)
+            # Send via Telegram API once start() has opened the HTTP session,
+            # otherwise the send is simulated
+            if self._http is not None and 'telegram' in notification['channels']:
+                await self._send_telegram(user_id, message)
+            elif self.settings['simulate_delay_seconds']:
+                # Optional simulated sending delay (testing only)
+                await asyncio.sleep(self.settings['simulate_delay_seconds'])
             
             # Mark as sent
             notification['status'] = 'SENT'
-            notification['delivered_at'] = datetime.now().isoformat()
+            notification['delivered_at'] = time.time()
             
-            # Add to sent notifications
-            self.sent_notifications.append(notification)
+            # Only delivered notifications count toward cooldown/hourly limits
+            self._last_sent[(user_id, notification['type'])] = notification['delivered_at']
+            self._hourly_sent[user_id].append(time.monotonic())
             
-            # Keep only last 1000 sent notifications
-            if len(self.sent_notifications) > 1000:
-                self.sent_notifications = self.sent_notifications[-1000:]
+            # Add to sent notifications (last 1000 kept)
+            if len(self.sent_notifications) == self.sent_notifications.maxlen:
+                self._count_sent(self.sent_notifications[0], -1)
+            self.sent_notifications.append(notification)
+            self._count_sent(notification, 1)
+            self._sent_recent.append(notification['ts'])
             
             self.logger.debug(f"Notification sent: {notification['id']} to user {user_id}")
             
-            # Log in database
-            self.db.add_log(
+            # Log in database (batched)
+            self._log_batch.append((
                 'notification_sent',
                 f"Notification sent: {notification['type']}",
                 user_id,
@@ -202,63 +316,128 @@ class Notifier:
                     'type': notification['type'],
                     'message_preview': message[:50]
                 }
-            )
+            ))
+            if len(self._log_batch) >= self.settings['log_batch_max']:
+                self._flush_logs()
+            
+        except _RetryAfter as e:
+            # Left PENDING; the caller puts it back at the front of the queue
+            notification['status'] = 'PENDING'
+            self.logger.warning(f"Notification {notification['id']} requeued: {e}")
             
         except Exception as e:
             notification['status'] = 'FAILED'
             notification['error'] = str(e)
             self.logger.error(f"Failed to process notification {notification['id']}: {e}")
     
-    async def _check_cooldown(self, user_id: int, notification_type: str) -> bool:
-        """Check if user has notification cooldown"""
-        cooldown_minutes = self.settings['notification_cooldown_minutes']
+    def _count_sent(self, notification: Dict, delta: int):
+        """Update stats counters when a sent notification is added/removed"""
+        for counter, key in ((self._sent_by_type, notification.get('type', 'unknown')),
+                             (self._sent_by_status, notification.get('status', 'unknown'))):
+            counter[key] += delta
+            if counter[key] <= 0:
+                del counter[key]
+    
+    async def _flush_loop(self):
+        """Send queued notifications in batches every flush interval"""
+        while True:
+            await asyncio.sleep(self.settings['flush_interval_seconds'])
+            
+            if not self.notification_queue:
+                continue
+            
+            # Wait out a Telegram rate limit before sending more
+            paused_for = self._send_paused_until - time.monotonic()
+            if paused_for > 0:
+                await asyncio.sleep(paused_for)
+            
+            batch = self.notification_queue[:self.settings['batch_max']]
+            del self.notification_queue[:len(batch)]
+            
+            try:
+                await asyncio.gather(*(self._process_notification(n) for n in batch))
+                retries = []
+                for notification in batch:
+                    # Requeued (429) notifications are recorded when they finish
+                    if notification['status'] == 'PENDING':
+                        retries.append(notification)
+                    else:
+                        self._update_user_history(notification['user_id'], notification)
+                # Back to the front as one block, keeping their original order
+                self.notification_queue[:0] = retries
+                self.logger.debug(f"Flushed {len(batch)} notifications")
+            except Exception as e:
+                self.logger.error(f"Notification flush failed: {e}")
+    
+    async def _send_telegram(self, user_id: int, message: str):
+        """Send a message through the Telegram Bot API"""
+        paused_for = self._send_paused_until - time.monotonic()
+        if paused_for > 0:
+            raise _RetryAfter(paused_for)
         
-        # Get user's recent notifications
-        recent_notifications = []
-        for notif in self.sent_notifications:
-            if notif['user_id'] == user_id and notif['type'] == notification_type:
-                recent_notifications.append(notif)
+        url = f"https://api.telegram.org/bot{self.config.BOT_TOKEN}/sendMessage"
         
-        if not recent_notifications:
-            return True
+        async with self._http.post(url, json={'chat_id': user_id, 'text': message}) as response:
+            result = await response.json()
+        
+        if response.status == 429 or result.get('error_code') == 429:
+            retry_after = result.get('parameters', {}).get('retry_after', 1)
+            self._send_paused_until = max(self._send_paused_until, time.monotonic() + retry_after)
+            raise _RetryAfter(retry_after)
         
-        # Check most recent notification
-        latest_notif = max(recent_notifications, key=lambda x: x.get('timestamp', ''))
-        sent_time = datetime.fromisoformat(latest_notif.get('timestamp', '2000-01-01'))
-        time_diff = datetime.now() - sent_time
+        if not result.get('ok'):
+            raise RuntimeError(result.get('description', f"HTTP {response.status}"))
+    
+    def _flush_logs(self):
+        """Write pending notification logs to the database in one batch"""
+        if not self._log_batch:
+            return
+        
+        entries = self._log_batch
+        self._log_batch = []
+        self.db.add_logs_batch(entries)
+    
+    async def _log_flush_loop(self):
+        """Flush notification logs every log flush interval"""
+        while True:
+            await asyncio.sleep(self.settings['log_flush_interval_seconds'])
+            try:
+                self._flush_logs()
+            except Exception as e:
+                self.logger.error(f"Notification log flush failed: {e}")
+    
+    async def _check_cooldown(self, user_id: int, notification_type: str) -> bool:
+        """Check if user has notification cooldown"""
+        cooldown_minutes = self.settings['notification_cooldown_minutes']
         
-        return time_diff.total_seconds() >= (cooldown_minutes * 60)
+        last_sent = self._last_sent.get((user_id, notification_type), 0)
+        return time.time() - last_sent >= (cooldown_minutes * 60)
     
     async def _check_hourly_limit(self, user_id: int) -> bool:
         """Check hourly notification limit"""
         max_per_hour = self.settings['max_notifications_per_hour']
-        one_hour_ago = datetime.now() - timedelta(hours=1)
         
-        # Count notifications in last hour
-        recent_count = 0
-        for notif in self.sent_notifications:
-            if notif['user_id'] == user_id:
-                sent_time = datetime.fromisoformat(notif.get('timestamp', '2000-01-01'))
-                if sent_time > one_hour_ago:
-                    recent_count += 1
+        sent_times = self._hourly_sent.get(user_id)
+        if not sent_times:
+            return True
+        
+        # Drop sends that fell out of the last hour
+        one_hour_ago = time.monotonic() - 3600
+        while sent_times and sent_times[0] <= one_hour_ago:
+            sent_times.popleft()
         
-        return recent_count < max_per_hour
+        return len(sent_times) < max_per_hour
     
     def _update_user_history(self, user_id: int, notification: Dict):
         """Update user notification history"""
-        if user_id not in self.user_notification_history:
-            self.user_notification_history[user_id] = []
-        
+        # Last 100 notifications per user are kept
         self.user_notification_history[user_id].append({
             'id': notification['id'],
             'type': notification['type'],
+            'ts': notification['ts'],
             'timestamp': notification['timestamp'],
             'status': notification['status']
         })
-        
-        # Keep only last 100 notifications per user
-        if len(self.user_notification_history[user_id]) > 100:
-            self.user_notification_history[user_id] = self.user_notification_history[user_id][-100:]
     
     async def send_bulk_notification(self, user_ids: List[int], notification_type: str, 
                                    data: Dict = None, priority: str = 'normal') -> Dict:
@@ -271,9 +450,15 @@ class Notifier:
                 'details': []
             }
             
-            for user_id in user_ids:
-                result = await self.send_notification(user_id, notification_type, data, priority)
-                
+            semaphore = asyncio.Semaphore(self.settings['bulk_concurrency'])
+            
+            async def send_one(user_id: int) -> Dict:
+                async with semaphore:
+                    return await self.send_notification(user_id, notification_type, data, priority)
+            
+            sent = await asyncio.gather(*(send_one(user_id) for user_id in user_ids))
+            
+            for user_id, result in zip(user_ids, sent):
                 if result['success']:
                     results['successful'] += 1
                 else:
@@ -298,22 +483,20 @@ class Notifier:
             self.logger.error(f"Bulk notification failed: {e}")
             return {'success': False, 'message': f'Bulk notification failed: {str(e)}'}
     
+    def refresh_admin_ids(self):
+        """Rebuild the admin recipient list (call after config/settings changes)"""
+        self._admin_ids = list(dict.fromkeys([
+            *self.config.ADMINS,
+            self.config.BOT_OWNER_ID,
+            *self.settings['emergency_contacts']
+        ]))
+    
     async def send_admin_notification(self, notification_type: str, data: Dict = None) -> Dict:
         """Send notification to admins"""
         try:
-            admin_ids = self.config.ADMINS.copy()
-            
-            if self.config.BOT_OWNER_ID not in admin_ids:
-                admin_ids.append(self.config.BOT_OWNER_ID)
-            
-            # Add emergency contacts
-            for contact in self.settings['emergency_contacts']:
-                if contact not in admin_ids:
-                    admin_ids.append(contact)
-            
             # Send to all admins
             result = await self.send_bulk_notification(
-                admin_ids, 
+                self._admin_ids, 
                 notification_type, 
                 data, 
                 priority='high'
@@ -378,15 +561,7 @@ class Notifier:
         """Send system maintenance notification"""
         if user_ids is None:
             # Send to all active users
-            active_users = []
-            cutoff = datetime.now() - timedelta(days=7)
-            
-            for user in self.db.users.values():
-                last_active = datetime.fromisoformat(user.get("last_active", "2000-01-01"))
-                if last_active > cutoff:
-                    active_users.append(user['id'])
-            
-            user_ids = active_users
+            user_ids = list(self.db.active_user_ids(7))
         
         data = {
             'start_time': start_time,
@@ -400,73 +575,68 @@ class Notifier:
         total_sent = len(self.sent_notifications)
         total_queued = len(self.notification_queue)
         
-        # Sent notifications by type
-        sent_by_type = {}
-        for notif in self.sent_notifications:
-            notif_type = notif.get('type', 'unknown')
-            sent_by_type[notif_type] = sent_by_type.get(notif_type, 0) + 1
-        
-        # Sent notifications by status
-        sent_by_status = {}
-        for notif in self.sent_notifications:
-            status = notif.get('status', 'unknown')
-            sent_by_status[status] = sent_by_status.get(status, 0) + 1
-        
-        # Recent notifications (last 24 hours)
-        one_day_ago = datetime.now() - timedelta(days=1)
-        recent_notifications = [
-            notif for notif in self.sent_notifications
-            if datetime.fromisoformat(notif.get('timestamp', '2000-01-01')) > one_day_ago
-        ]
+        # Recent notifications (last 24 hours); sent_notifications only
+        # ever drops its oldest entries, so the newest `total_sent` of
+        # these are still retained
+        one_day_ago = time.time() - 86400
+        while self._sent_recent and self._sent_recent[0] <= one_day_ago:
+            self._sent_recent.popleft()
         
         return {
             'total_sent': total_sent,
             'total_queued': total_queued,
-            'sent_by_type': sent_by_type,
-            'sent_by_status': sent_by_status,
-            'recent_24h': len(recent_notifications),
+            'sent_by_type': dict(self._sent_by_type),
+            'sent_by_status': dict(self._sent_by_status),
+            'recent_24h': min(len(self._sent_recent), total_sent),
             'unique_users': len(self.user_notification_history),
             'settings': self.settings
         }
     
     def get_user_notification_history(self, user_id: int, limit: int = 20) -> List[Dict]:
         """Get user's notification history"""
-        user_history = self.user_notification_history.get(user_id, [])
-        
-        # Sort by timestamp (newest first)
-        user_history.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
+        user_history = self.user_notification_history.get(user_id, ())
         
-        return user_history[:limit]
+        # History is appended in send order, so newest first is just reversed
+        return list(islice(reversed(user_history), limit))
     
     async def cleanup_old_notifications(self, days_to_keep: int = None):
         """Cleanup old notifications"""
         if days_to_keep is None:
             days_to_keep = self.settings['auto_cleanup_days']
         
-        cutoff_date = datetime.now() - timedelta(days=days_to_keep)
+        cutoff_ts = time.time() - days_to_keep * 86400
         
-        # Cleanup sent notifications
-        initial_count = len(self.sent_notifications)
-        self.sent_notifications = [
-            notif for notif in self.sent_notifications
-            if datetime.fromisoformat(notif.get('timestamp', '2000-01-01')) > cutoff_date
-        ]
-        removed_sent = initial_count - len(self.sent_notifications)
+        # Cleanup sent notifications (oldest first)
+        removed_sent = 0
+        sent = self.sent_notifications
+        while sent and sent[0]['ts'] <= cutoff_ts:
+            self._count_sent(sent.popleft(), -1)
+            removed_sent += 1
         
         # Cleanup user history
         removed_user_history = 0
         for user_id in list(self.user_notification_history.keys()):
-            initial_user_count = len(self.user_notification_history[user_id])
-            self.user_notification_history[user_id] = [
-                notif for notif in self.user_notification_history[user_id]
-                if datetime.fromisoformat(notif.get('timestamp', '2000-01-01')) > cutoff_date
-            ]
-            removed_user_history += initial_user_count - len(self.user_notification_history[user_id])
+            user_history = self.user_notification_history[user_id]
+            while user_history and user_history[0]['ts'] <= cutoff_ts:
+                user_history.popleft()
+                removed_user_history += 1
             
             # Remove empty user history
-            if not self.user_notification_history[user_id]:
+            if not user_history:
                 del self.user_notification_history[user_id]
         
+        # Cleanup cooldown and hourly indexes
+        self._last_sent = {
+            key: sent_at for key, sent_at in self._last_sent.items()
+            if sent_at > cutoff_ts
+        }
+        
+        one_hour_ago = time.monotonic() - 3600
+        for user_id in list(self._hourly_sent.keys()):
+            sent_times = self._hourly_sent[user_id]
+            if not sent_times or sent_times[-1] <= one_hour_ago:
+                del self._hourly_sent[user_id]
+        
         self.logger.info(f"🧹 Cleaned up notifications: {removed_sent} sent, {removed_user_history} user history entries")
         
         return {
@@ -478,32 +648,44 @@ class Notifier:
     
     def setup_scheduled_notifications(self):
         """Setup scheduled notifications"""
-        # Daily bonus reminder at 9 AM
-        schedule.every().day.at("09:00").do(self._daily_bonus_reminder)
-        
-        # Inactive user reminder at 6 PM
-        schedule.every().day.at("18:00").do(self._inactive_user_reminder)
-        
-        # Weekly summary on Monday at 10 AM
-        schedule.every().monday.at("10:00").do(self._weekly_summary)
-        
-        # System health check every 4 hours
-        schedule.every(4).hours.do(self._system_health_check)
+        self._scheduled_jobs = [
+            # Daily bonus reminder at 9 AM
+            (self._daily_bonus_reminder, {'hour': 9, 'minute': 0}),
+            
+            # Inactive user reminder at 6 PM
+            (self._inactive_user_reminder, {'hour': 18, 'minute': 0}),
+            
+            # Weekly summary on Monday at 10 AM
+            (self._weekly_summary, {'hour': 10, 'minute': 0, 'weekday': 0}),
+            
+            # System health check every 4 hours
+            (self._system_health_check, {'every_hours': 4})
+        ]
         
         self.logger.info("⏰ Scheduled notifications setup completed")
     
+    @staticmethod
+    def _next_run(spec: Dict, now: datetime) -> datetime:
+        """Get the next run time of a scheduled job after `now`"""
+        if 'every_hours' in spec:
+            return now + timedelta(hours=spec['every_hours'])
+        
+        next_run = now.replace(hour=spec['hour'], minute=spec['minute'], second=0, microsecond=0)
+        if 'weekday' in spec:
+            next_run += timedelta(days=(spec['weekday'] - now.weekday()) % 7)
+            if next_run <= now:
+                next_run += timedelta(days=7)
+        elif next_run <= now:
+            next_run += timedelta(days=1)
+        
+        return next_run
+    
     async def _daily_bonus_reminder(self):
         """Send daily bonus reminder"""
         self.logger.info("⏰ Sending daily bonus reminders...")
         
         # Get users who haven't claimed daily bonus today
-        today = datetime.now().strftime('%Y-%m-%d')
-        users_to_notify = []
-        
-        for user in self.db.users.values():
-            last_daily = user.get('last_daily')
-            if last_daily != today:
-                users_to_notify.append(user['id'])
+        users_to_notify = list(self.db.active_user_ids() - self._get_daily_claimed_today())
         
         if users_to_notify:
             await self.send_bulk_notification(
@@ -516,13 +698,7 @@ class Notifier:
         """Send reminders to inactive users"""
         self.logger.info("⏰ Sending inactive user reminders...")
         
-        cutoff_date = datetime.now() - timedelta(days=3)
-        users_to_notify = []
-        
-        for user in self.db.users.values():
-            last_active = datetime.fromisoformat(user.get('last_active', '2000-01-01'))
-            if last_active < cutoff_date:
-                users_to_notify.append(user['id'])
+        users_to_notify = list(self.db.inactive_user_ids(3))
         
         if users_to_notify:
             await self.send_bulk_notification(
@@ -537,13 +713,7 @@ class Notifier:
         self.logger.info("⏰ Sending weekly summaries...")
         
         # Get active users (active in last week)
-        cutoff_date = datetime.now() - timedelta(days=7)
-        active_users = []
-        
-        for user in self.db.users.values():
-            last_active = datetime.fromisoformat(user.get('last_active', '2000-01-01'))
-            if last_active > cutoff_date:
-                active_users.append(user['id'])
+        active_users = list(self.db.active_user_ids(7))
         
         if active_users:
             await self.send_bulk_notification(
@@ -576,18 +746,61 @@ class Notifier:
         except Exception as e:
             self.logger.error(f"System health check failed: {e}")
     
-    def run_scheduler(self):
-        """Run notification scheduler in background"""
+    async def _scheduler(self):
+        """Run scheduled notification jobs at their next run times"""
         self.logger.info("🚀 Starting notification scheduler...")
         
         self.setup_scheduled_notifications()
+        now = datetime.now()
+        next_runs = [self._next_run(spec, now) for _, spec in self._scheduled_jobs]
         
         while True:
-            schedule.run_pending()
-            time.sleep(60)  # Check every minute
-    
-    def start(self):
-        """Start notification scheduler in background thread"""
-        scheduler_thread = threading.Thread(target=self.run_scheduler, daemon=True)
-        scheduler_thread.start()
-        self.logger.info("✅ Notification scheduler started")
\ No newline at end of file
+            index = min(range(len(next_runs)), key=next_runs.__getitem__)
+            delay = (next_runs[index] - datetime.now()).total_seconds()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            
+            job, spec = self._scheduled_jobs[index]
+            try:
+                await job()
+            except Exception as e:
+                self.logger.error(f"Scheduled notification job {job.__name__} failed: {e}")
+            
+            next_runs[index] = self._next_run(spec, datetime.now())
+    
+    async def start(self):
+        """Start notification scheduler and batching on the running event loop"""
+        if self._scheduler_task is None:
+            self._scheduler_task = asyncio.create_task(self._scheduler())
+        
+        # Until started, send_notification sends immediately
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+            self.logger.info("📦 Notification batching enabled")
+        
+        if self._log_flush_task is None:
+            self._log_flush_task = asyncio.create_task(self._log_flush_loop())
+        
+        if self._http is None and self.config.BOT_TOKEN:
+            self._http = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=100, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+        
+        self.logger.info("✅ Notification scheduler started")
+    
+    async def stop(self):
+        """Stop background notification tasks"""
+        for task in (self._scheduler_task, self._flush_task, self._log_flush_task):
+            if task is not None:
+                task.cancel()
+        
+        self._scheduler_task = None
+        self._flush_task = None
+        self._log_flush_task = None
+        self._flush_logs()
+        
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+        self.logger.info("🛑 Notification scheduler stopped")
@@ -1,21 +1,69 @@
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
-import random
+from collections import Counter, defaultdict, namedtuple
+import heapq
 import json
+import os
+import pickle
+import sys
+import threading
+import time
 from config import Config
 from db import Database
 from utils import Utils
 import asyncio
 
+# Payment statuses and types
+PENDING, COMPLETED, REJECTED, FAILED = map(sys.intern, ("PENDING", "COMPLETED", "REJECTED", "FAILED"))
+DEPOSIT, WITHDRAW = map(sys.intern, ("DEPOSIT", "WITHDRAW"))
+_FAILED_STATUSES = frozenset({REJECTED, FAILED})
+
+_STATUS_ICONS = {
+    PENDING: "⏳",
+    COMPLETED: "✅",
+    REJECTED: "❌",
+    FAILED: "❌"
+}
+_TYPE_ICONS = {DEPOSIT: "💰", WITHDRAW: "🏧"}
+
+# Reference alphabet (32 symbols, no 0/O/1/I); maps every byte value via its low 5 bits
+_REF_ALPHABET = b"ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+_REF_TABLE = bytes(_REF_ALPHABET[i & 0x1F] for i in range(256))
+
+# Compact in-memory record for deposits awaiting confirmation
+PendingPayment = namedtuple("PendingPayment", "user_id amount method timestamp")
+
+# Shared error payloads
+_ERR_NOT_FOUND = "পেমেন্ট খুঁজে পাওয়া যায়নি!"
+
+def _err(message: str) -> Dict:
+    """Build a failed-operation response"""
+    return {"success": False, "message": message}
+
 class PaymentManager:
     """Advanced Payment Management System v15.0.00"""
     
     def __init__(self, db: Database):
         self.db = db
         self.config = Config()
+        # Insertion-ordered, so the oldest pending entries come first
         self.pending_payments = {}
+        self.pending_ttl_seconds = 86400
+        self.pending_gc_interval_seconds = 60
+        self._pending_gc_task = None
         self.payment_webhooks = {}
         
+        # Coalesced payments saves (active once start() is called)
+        self.flush_interval_ms = 500
+        self._payments_dirty = asyncio.Event()
+        self._flush_task = None
+        # Snapshots are numbered so a slow write never overwrites a newer one
+        self._snapshot_seq = 0
+        self._written_seq = 0
+        self._write_lock = threading.Lock()
+        self._now_iso_cache = ("", 0)
+        self._now_compact_cache = ("", 0)
+        
         # Payment methods configuration
         self.payment_methods = {
             "nagod": {
@@ -59,38 +107,192 @@ class PaymentManager:
                 "supported": True
             }
         }
+        
+        # Static display strings derived from payment_methods
+        self._methods_display = ', '.join(m['name'] for m in self.payment_methods.values())
+        self._unsupported_method_msg = f"সাপোর্টেড পেমেন্ট মেথড: {self._methods_display}"
+        self._deposit_tmpl = self._build_deposit_templates()
+        self._public_methods = self._build_public_methods()
+        
+        # (user_id, "YYYY-MM-DD") -> amount counted toward the daily cap;
+        # only today's keys are kept (see _prune_withdraw_sums)
+        self._withdraw_sum_by_user_day = defaultdict(float)
+        self._withdraw_sums_day = None
+        
+        # Running payment stats, kept in step with every status change
+        self._stats_global = Counter()
+        self._stats_by_user = defaultdict(Counter)
+        
+        self._build_payment_indexes()
+        self.db.add_restore_listener(self._build_payment_indexes)
+    
+    def _build_payment_indexes(self):
+        """Rebuild withdrawal totals and running stats from stored payments"""
+        self._withdraw_sum_by_user_day.clear()
+        self._withdraw_sums_day = None
+        self._stats_global.clear()
+        self._stats_by_user.clear()
+        for payment_id, payment in self.db.payments.items():
+            # Unpickled strings are not interned; share the module constants
+            for field in ("status", "type"):
+                if isinstance(payment.get(field), str):
+                    payment[field] = sys.intern(payment[field])
+            self._index_payment(payment)
+            self._track_payment(payment)
+        self._prune_withdraw_sums(self._now_iso()[:10])
+    
+    def _apply_delta(self, user_id: int, deltas: Dict):
+        """Apply stats deltas globally and for the user"""
+        self._stats_global.update(deltas)
+        self._stats_by_user[user_id].update(deltas)
+    
+    def _track_payment(self, payment: Dict, sign: int = 1):
+        """Add (sign=1) or remove (sign=-1) a payment's contribution to stats"""
+        amount = payment.get("amount", 0) * sign
+        status = payment.get("status", PENDING)
+        deltas = {"total_transactions": sign}
+        
+        if payment["type"] == DEPOSIT:
+            deltas["total_deposits"] = amount
+            deltas["n_deposits"] = sign
+            if status == PENDING:
+                deltas["pending_deposits"] = amount
+        elif payment["type"] == WITHDRAW:
+            deltas["total_withdrawals"] = amount
+            deltas["n_withdrawals"] = sign
+            if status == PENDING:
+                deltas["pending_withdrawals"] = amount
+        
+        if status == COMPLETED:
+            deltas["successful"] = sign
+        elif status in _FAILED_STATUSES:
+            deltas["failed"] = sign
+        
+        self._apply_delta(payment.get("user_id"), deltas)
+    
+    async def start(self):
+        """Start coalescing payment saves and pending cleanup on the running event loop"""
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flusher())
+        if self._pending_gc_task is None:
+            self._pending_gc_task = asyncio.create_task(self._pending_gc())
+    
+    async def stop(self):
+        """Stop background tasks and write any pending payment changes"""
+        for task in (self._flush_task, self._pending_gc_task):
+            if task is not None:
+                task.cancel()
+        self._flush_task = None
+        self._pending_gc_task = None
+        self.flush_now()
+    
+    async def _pending_gc(self):
+        """Periodically drop pending entries older than the TTL"""
+        while True:
+            await asyncio.sleep(self.pending_gc_interval_seconds)
+            self._expire_pending(time.time())
+    
+    def _expire_pending(self, now: float) -> int:
+        """Remove expired pending entries, oldest first"""
+        cutoff = now - self.pending_ttl_seconds
+        expired = []
+        for payment_id, entry in self.pending_payments.items():
+            if entry.timestamp >= cutoff:
+                break
+            expired.append(payment_id)
+        
+        for payment_id in expired:
+            del self.pending_payments[payment_id]
+        return len(expired)
+    
+    async def _flusher(self):
+        """Save payments at most once per flush interval while dirty"""
+        while True:
+            await self._payments_dirty.wait()
+            await asyncio.sleep(self.flush_interval_ms / 1000)
+            # Snapshot on the loop, where payments are mutated; only the
+            # file write goes to a worker thread
+            snapshot = self._snapshot_payments()
+            if snapshot is not None:
+                await asyncio.to_thread(self._write_snapshot, snapshot)
+    
+    def _snapshot_payments(self) -> Optional[Tuple[int, bytes]]:
+        """Pickle payments if there are unsaved changes (clears the dirty flag)"""
+        if not self._payments_dirty.is_set():
+            return None
+        self._payments_dirty.clear()
+        with self.db.lock:
+            payload = pickle.dumps(self.db.payments, protocol=pickle.HIGHEST_PROTOCOL)
+        self._snapshot_seq += 1
+        return self._snapshot_seq, payload
+    
+    def _write_snapshot(self, snapshot: Tuple[int, bytes]):
+        """Write a payments snapshot unless a newer one is already on disk"""
+        seq, payload = snapshot
+        with self._write_lock:
+            if seq <= self._written_seq:
+                return
+            self.db._save_raw("payments", payload)
+            self._written_seq = seq
+    
+    def flush_now(self):
+        """Write payments to disk if there are unsaved changes"""
+        snapshot = self._snapshot_payments()
+        if snapshot is not None:
+            self._write_snapshot(snapshot)
+    
+    async def _save_payments(self):
+        """Mark payments dirty; saves immediately until start() is called"""
+        self._payments_dirty.set()
+        if self._flush_task is None:
+            snapshot = self._snapshot_payments()
+            await asyncio.to_thread(self._write_snapshot, snapshot)
+    
+    def _now_iso(self) -> str:
+        """Current time as ISO string, formatted at most once per second"""
+        now = int(time.time())
+        cached, cached_sec = self._now_iso_cache
+        if now != cached_sec:
+            cached = datetime.fromtimestamp(now).isoformat()
+            self._now_iso_cache = (cached, now)
+        return cached
+    
+    def _index_payment(self, payment: Dict):
+        """Add a withdrawal to the per-user daily totals"""
+        if payment.get("type") != WITHDRAW:
+            return
+        if payment.get("status") not in _FAILED_STATUSES:
+            key = (payment.get("user_id"), payment.get("requested_at", "")[:10])
+            self._withdraw_sum_by_user_day[key] += payment.get("amount", 0)
+    
+    def _prune_withdraw_sums(self, today: str):
+        """Drop daily withdrawal totals for days other than today"""
+        if today == self._withdraw_sums_day:
+            return
+        stale = [key for key in self._withdraw_sum_by_user_day if key[1] != today]
+        for key in stale:
+            del self._withdraw_sum_by_user_day[key]
+        self._withdraw_sums_day = today
     
     async def request_deposit(self, user_id: int, amount: float, method: str, trx_id: str = None) -> Dict:
         """Request deposit with advanced validation"""
         # Validate amount
         if amount < self.config.MIN_DEPOSIT:
-            return {
-                "success": False,
-                "message": f"ন্যূনতম ডিপোজিট {self.config.MIN_DEPOSIT} টাকা"
-            }
+            return _err(f"ন্যূনতম ডিপোজিট {self.config.MIN_DEPOSIT} টাকা")
         
         if amount > 50000:  # Max deposit limit
-            return {
-                "success": False,
-                "message": "সর্বোচ্চ ডিপোজিট ৫০,০০০ টাকা"
-            }
+            return _err("সর্বোচ্চ ডিপোজিট ৫০,০০০ টাকা")
         
         # Validate payment method
         method_lower = method.lower()
         if method_lower not in self.payment_methods:
-            return {
-                "success": False,
-                "message": f"সাপোর্টেড পেমেন্ট মেথড: {', '.join([m['name'] for m in self.payment_methods.values()])}"
-            }
+            return _err(self._unsupported_method_msg)
         
         payment_method = self.payment_methods[method_lower]
         
         # Check if method is supported
         if not payment_method["supported"]:
-            return {
-                "success": False,
-                "message": f"{payment_method['name']} বর্তমানে সাপোর্ট করছে না"
-            }
+            return _err(f"{payment_method['name']} বর্তমানে সাপোর্ট করছে না")
         
         # Calculate fees
         fee = amount * (payment_method["fee_percent"] / 100)
@@ -99,18 +301,18 @@ class PaymentManager:
         # Create payment data
         payment_data = {
             "user_id": user_id,
-            "type": "DEPOSIT",
+            "type": DEPOSIT,
             "method": payment_method["name"],
             "method_code": method_lower,
             "amount": amount,
             "net_amount": net_amount,
             "fee": fee,
             "fee_percent": payment_method["fee_percent"],
-            "status": "PENDING",
+            "status": PENDING,
             "trx_id": trx_id,
             "reference": self._generate_reference(),
-            "requested_at": datetime.now().isoformat(),
-            "instructions": self._get_deposit_instructions(payment_method, amount, net_amount, fee),
+            "requested_at": self._now_iso(),
+            "instructions": self._get_deposit_instructions(method_lower, amount, net_amount, fee),
             "metadata": {
                 "user_ip": "N/A",
                 "user_agent": "Telegram Bot",
@@ -120,14 +322,10 @@ class PaymentManager:
         
         # Add payment to database
         payment_id = self.db.add_payment(payment_data)
+        self._track_payment(payment_data)
         
         # Store in pending payments
-        self.pending_payments[payment_id] = {
-            "user_id": user_id,
-            "amount": amount,
-            "method": method_lower,
-            "timestamp": datetime.now().timestamp()
-        }
+        self.pending_payments[payment_id] = PendingPayment(user_id, amount, method_lower, time.time())
         
         # Log the payment request
         self.db.add_log(
@@ -147,19 +345,21 @@ class PaymentManager:
             "estimated_time": payment_method["processing_time"]
         }
     
-    def _get_deposit_instructions(self, method: Dict, amount: float, net_amount: float, fee: float) -> str:
-        """Generate deposit instructions"""
-        instructions = f"""
+    def _build_deposit_templates(self) -> Dict[str, str]:
+        """Pre-render the static parts of each method's deposit instructions"""
+        templates = {}
+        for code, method in self.payment_methods.items():
+            templates[code] = f"""
 💰 **{method['name']} ডিপোজিট ইনস্ট্রাকশন**
 
 {method['emoji']} **পেমেন্ট নম্বর:** `{method['number']}`
-💵 **পরিমাণ:** {Utils.format_currency(amount)}
-📌 **রেফারেন্স:** MARPD-{datetime.now().strftime('%H%M')}
+💵 **পরিমাণ:** {{amount}}
+📌 **রেফারেন্স:** MARPD-{{hhmm}}
 
 📊 **বিস্তারিত:**
-• Gross Amount: {Utils.format_currency(amount)}
-• Fee ({method['fee_percent']}%): {Utils.format_currency(fee)}
-• Net Amount: {Utils.format_currency(net_amount)}
+• Gross Amount: {{amount}}
+• Fee ({method['fee_percent']}%): {{fee}}
+• Net Amount: {{net}}
 • Processing Time: {method['processing_time']}
 
 ✅ **পেমেন্ট করার নিয়ম:**
@@ -171,25 +371,27 @@ class PaymentManager:
 📞 **সাপোর্ট:** @{self.config.OWNER_USERNAME}
 ⚠️ **দ্রষ্টব্য:** ভুল রেফারেন্স দিলে পেমেন্ট ডিলে হতে পারে
         """
-        
-        return instructions
+        return templates
+    
+    def _get_deposit_instructions(self, method_code: str, amount: float, net_amount: float, fee: float) -> str:
+        """Generate deposit instructions"""
+        t = time.localtime()
+        return self._deposit_tmpl[method_code].format(
+            amount=Utils.format_currency(amount),
+            fee=Utils.format_currency(fee),
+            net=Utils.format_currency(net_amount),
+            hhmm=f"{t.tm_hour:02d}{t.tm_min:02d}"
+        )
     
     async def confirm_deposit(self, payment_id: str, trx_id: str, admin_id: int = None) -> Dict:
         """Confirm deposit (can be auto or manual)"""
         payment = self.db.payments.get(payment_id)
         
         if not payment:
-            return {
-                "success": False,
-                "message": "পেমেন্ট খুঁজে পাওয়া যায়নি!"
-            }
+            return _err(_ERR_NOT_FOUND)
         
-        if payment["status"] != "PENDING":
-            current_status = payment["status"]
-            return {
-                "success": False,
-                "message": f"পেমেন্ট ইতিমধ্যে {current_status}!"
-            }
+        if payment["status"] != PENDING:
+            return _err(f"পেমেন্ট ইতিমধ্যে {payment['status']}!")
         
         # Auto-confirmation logic (for trusted payments)
         is_auto_confirm = admin_id is None
@@ -203,20 +405,19 @@ class PaymentManager:
             if amount <= 500 and method in ["nagod", "bikash"]:
                 admin_id = 0  # System auto-confirm
             else:
-                return {
-                    "success": False,
-                    "message": "এই পেমেন্ট ম্যানুয়াল কনফার্মেশন প্রয়োজন!"
-                }
+                return _err("এই পেমেন্ট ম্যানুয়াল কনফার্মেশন প্রয়োজন!")
         
         # Update payment status
-        payment["status"] = "COMPLETED"
+        self._track_payment(payment, -1)
+        payment["status"] = COMPLETED
         payment["confirmed_by"] = admin_id
-        payment["confirmed_at"] = datetime.now().isoformat()
+        payment["confirmed_at"] = self._now_iso()
         payment["trx_id"] = trx_id
+        self._track_payment(payment)
         
         # Add bonus for first deposit
         user = self.db.get_user(payment["user_id"])
-        is_first_deposit = len(self.db.get_user_payments(payment["user_id"])) == 0
+        is_first_deposit = bool(user) and not self._has_deposited(user, payment)
         
         deposit_bonus = 0
         if is_first_deposit:
@@ -240,16 +441,16 @@ class PaymentManager:
                 "balance": user["balance"],
                 "total_earned": user["total_earned"],
                 "xp": user["xp"],
-                "total_xp": user["total_xp"]
+                "total_xp": user["total_xp"],
+                "has_deposited": True
             })
         
         # Save payment
         self.db.payments[payment_id] = payment
-        self.db._save_data("payments", self.db.payments)
+        await self._save_payments()
         
         # Remove from pending
-        if payment_id in self.pending_payments:
-            del self.pending_payments[payment_id]
+        self.pending_payments.pop(payment_id, None)
         
         # Log the confirmation
         self.db.add_log(
@@ -277,56 +478,36 @@ class PaymentManager:
         user = self.db.get_user(user_id)
         
         if not user:
-            return {
-                "success": False,
-                "message": "ইউজার খুঁজে পাওয়া যায়নি!"
-            }
+            return _err("ইউজার খুঁজে পাওয়া যায়নি!")
         
         # Validate amount
         if amount < self.config.MIN_WITHDRAW:
-            return {
-                "success": False,
-                "message": f"ন্যূনতম উইথড্র {self.config.MIN_WITHDRAW} টাকা"
-            }
+            return _err(f"ন্যূনতম উইথড্র {self.config.MIN_WITHDRAW} টাকা")
         
         if amount > self.config.MAX_WITHDRAW_DAILY:
-            return {
-                "success": False,
-                "message": f"সর্বোচ্চ উইথড্র {Utils.format_currency(self.config.MAX_WITHDRAW_DAILY)} প্রতি দিন"
-            }
+            return _err(f"সর্বোচ্চ উইথড্র {Utils.format_currency(self.config.MAX_WITHDRAW_DAILY)} প্রতি দিন")
         
         # Check daily withdrawal limit
-        today_withdrawals = await self._get_today_withdrawals(user_id)
-        total_today = sum(w["amount"] for w in today_withdrawals)
+        today = self._now_iso()[:10]
+        self._prune_withdraw_sums(today)
+        total_today = self._withdraw_sum_by_user_day.get((user_id, today), 0.0)
         
         if total_today + amount > self.config.MAX_WITHDRAW_DAILY:
             remaining = self.config.MAX_WITHDRAW_DAILY - total_today
-            return {
-                "success": False,
-                "message": f"আজকের উইথড্র লিমিট শেষ! বাকি আছে: {Utils.format_currency(remaining)}"
-            }
+            return _err(f"আজকের উইথড্র লিমিট শেষ! বাকি আছে: {Utils.format_currency(remaining)}")
         
         # Check balance
         if user["balance"] < amount:
-            return {
-                "success": False,
-                "message": f"পর্যাপ্ত ব্যালেন্স নেই! আপনার ব্যালেন্স: {Utils.format_currency(user['balance'])}"
-            }
+            return _err(f"পর্যাপ্ত ব্যালেন্স নেই! আপনার ব্যালেন্স: {Utils.format_currency(user['balance'])}")
         
         # Validate payment method
         method_lower = method.lower()
         if method_lower not in self.payment_methods:
-            return {
-                "success": False,
-                "message": f"সাপোর্টেড পেমেন্ট মেথড: {', '.join([m['name'] for m in self.payment_methods.values()])}"
-            }
+            return _err(self._unsupported_method_msg)
         
         # Validate account number
         if not Utils.validate_phone(account_number):
-            return {
-                "success": False,
-                "message": "সঠিক মোবাইল নম্বর দিন (11 ডিজিট)"
-            }
+            return _err("সঠিক মোবাইল নম্বর দিন (11 ডিজিট)")
         
         payment_method = self.payment_methods[method_lower]
         
@@ -337,17 +518,17 @@ class PaymentManager:
         # Create withdrawal data
         payment_data = {
             "user_id": user_id,
-            "type": "WITHDRAW",
+            "type": WITHDRAW,
             "method": payment_method["name"],
             "method_code": method_lower,
             "amount": amount,
             "net_amount": net_amount,
             "fee": fee,
             "fee_percent": payment_method["fee_percent"],
-            "status": "PENDING",
+            "status": PENDING,
             "account_number": account_number,
             "reference": self._generate_reference(),
-            "requested_at": datetime.now().isoformat(),
+            "requested_at": self._now_iso(),
             "metadata": {
                 "daily_withdrawal": total_today + amount,
                 "user_level": user.get("level", 1),
@@ -366,6 +547,8 @@ class PaymentManager:
         
         # Add payment to database
         payment_id = self.db.add_payment(payment_data)
+        self._index_payment(payment_data)
+        self._track_payment(payment_data)
         
         # Send notification to admin
         admin_notification = self._create_admin_notification(payment_id, user, payment_data)
@@ -419,37 +602,42 @@ class PaymentManager:
 • সতর্কতা: {user.get('warnings', 0)}/3
         """
     
+    def _has_deposited(self, user: Dict, current: Dict) -> bool:
+        """Check if the user already has a completed deposit"""
+        has_deposited = user.get("has_deposited")
+        if has_deposited is None:
+            # Users created before the flag existed: look it up once
+            user_id = user["id"]
+            has_deposited = any(
+                p is not current and p.get("user_id") == user_id and
+                p.get("type") == DEPOSIT and p.get("status") == COMPLETED
+                for p in self.db.payments.values()
+            )
+        return has_deposited
+    
     async def confirm_withdraw(self, payment_id: str, admin_id: int) -> Dict:
         """Confirm withdrawal (admin only)"""
         payment = self.db.payments.get(payment_id)
         
         if not payment:
-            return {
-                "success": False,
-                "message": "পেমেন্ট খুঁজে পাওয়া যায়নি!"
-            }
+            return _err(_ERR_NOT_FOUND)
         
-        if payment["status"] != "PENDING":
-            return {
-                "success": False,
-                "message": f"পেমেন্ট ইতিমধ্যে {payment['status']}!"
-            }
+        if payment["status"] != PENDING:
+            return _err(f"পেমেন্ট ইতিমধ্যে {payment['status']}!")
         
-        if payment["type"] != "WITHDRAW":
-            return {
-                "success": False,
-                "message": "শুধুমাত্র উইথড্র পেমেন্ট কনফার্ম করা যায়!"
-            }
+        if payment["type"] != WITHDRAW:
+            return _err("শুধুমাত্র উইথড্র পেমেন্ট কনফার্ম করা যায়!")
         
         # Update payment status
-        payment["status"] = "COMPLETED"
+        self._track_payment(payment, -1)
+        payment["status"] = COMPLETED
         payment["confirmed_by"] = admin_id
-        payment["confirmed_at"] = datetime.now().isoformat()
-        payment["processed_at"] = datetime.now().isoformat()
+        payment["confirmed_at"] = payment["processed_at"] = self._now_iso()
+        self._track_payment(payment)
         
         # Save payment
         self.db.payments[payment_id] = payment
-        self.db._save_data("payments", self.db.payments)
+        await self._save_payments()
         
         # Get user
         user = self.db.get_user(payment["user_id"])
@@ -476,33 +664,37 @@ class PaymentManager:
         payment = self.db.payments.get(payment_id)
         
         if not payment:
-            return {
-                "success": False,
-                "message": "পেমেন্ট খুঁজে পাওয়া যায়নি!"
-            }
+            return _err(_ERR_NOT_FOUND)
         
-        if payment["status"] != "PENDING":
-            return {
-                "success": False,
-                "message": f"পেমেন্ট ইতিমধ্যে {payment['status']}!"
-            }
+        if payment["status"] != PENDING:
+            return _err(f"পেমেন্ট ইতিমধ্যে {payment['status']}!")
         
         # Refund balance if it's a withdrawal
-        if payment["type"] == "WITHDRAW":
+        if payment["type"] == WITHDRAW:
+            # Refunded withdrawals no longer count toward the daily cap
+            key = (payment["user_id"], payment.get("requested_at", "")[:10])
+            if key in self._withdraw_sum_by_user_day:
+                self._withdraw_sum_by_user_day[key] -= payment["amount"]
+            
             user = self.db.get_user(payment["user_id"])
             if user:
                 user["balance"] += payment["amount"]
                 self.db.update_user(payment["user_id"], {"balance": user["balance"]})
         
         # Update payment status
-        payment["status"] = "REJECTED"
+        self._track_payment(payment, -1)
+        payment["status"] = REJECTED
         payment["rejected_by"] = admin_id
-        payment["rejected_at"] = datetime.now().isoformat()
+        payment["rejected_at"] = self._now_iso()
         payment["rejection_reason"] = reason
+        self._track_payment(payment)
         
         # Save payment
         self.db.payments[payment_id] = payment
-        self.db._save_data("payments", self.db.payments)
+        await self._save_payments()
+        
+        # Remove from pending
+        self.pending_payments.pop(payment_id, None)
         
         # Log the rejection
         self.db.add_log(
@@ -516,15 +708,28 @@ class PaymentManager:
             "success": True,
             "message": f"❌ পেমেন্ট রিজেক্ট হয়েছে। কারণ: {reason}",
             "payment_id": payment_id,
-            "refunded": payment["type"] == "WITHDRAW"
+            "refunded": payment["type"] == WITHDRAW
         }
     
     async def get_payment_history(self, user_id: int, limit: int = 10, page: int = 1) -> Dict:
         """Get user's payment history with pagination"""
-        all_payments = self.db.get_user_payments(user_id)
+        # One pass: collect the user's payments and summarize all pages
+        all_payments = []
+        total_deposits = 0
+        total_withdrawals = 0
+        completed_count = 0
         
-        # Sort by date (newest first)
-        all_payments.sort(key=lambda x: x.get("requested_at", ""), reverse=True)
+        for payment in self.db.payments.values():
+            if payment.get("user_id") != user_id:
+                continue
+            all_payments.append(payment)
+            
+            if payment.get("status") == COMPLETED:
+                completed_count += 1
+                if payment["type"] == DEPOSIT:
+                    total_deposits += payment.get("amount", 0)
+                elif payment["type"] == WITHDRAW:
+                    total_withdrawals += payment.get("amount", 0)
         
         # Pagination
         total_payments = len(all_payments)
@@ -533,22 +738,21 @@ class PaymentManager:
         
         start_idx = (page - 1) * limit
         end_idx = start_idx + limit
-        payments = all_payments[start_idx:end_idx]
+        
+        # Newest first; only rank as many as the requested page needs
+        sort_key = lambda x: x.get("requested_at", "")
+        if end_idx * 2 < total_payments:
+            newest = heapq.nlargest(end_idx, all_payments, key=sort_key)
+        else:
+            newest = sorted(all_payments, key=sort_key, reverse=True)
+        payments = newest[start_idx:end_idx]
         
         # Format payments for display
         formatted_payments = []
-        total_deposits = 0
-        total_withdrawals = 0
         
         for payment in payments:
-            status_icon = {
-                "PENDING": "⏳",
-                "COMPLETED": "✅",
-                "REJECTED": "❌",
-                "FAILED": "❌"
-            }.get(payment.get("status", "PENDING"), "❓")
-            
-            type_icon = "💰" if payment["type"] == "DEPOSIT" else "🏧"
+            status_icon = _STATUS_ICONS.get(payment.get("status", PENDING), "❓")
+            type_icon = _TYPE_ICONS.get(payment["type"], "🏧")
             
             formatted_payments.append({
                 "id": payment.get("id", "N/A"),
@@ -561,11 +765,6 @@ class PaymentManager:
                 "time": payment.get("requested_at", "N/A")[:16],
                 "reference": payment.get("reference", "N/A")
             })
-            
-            if payment["type"] == "DEPOSIT" and payment.get("status") == "COMPLETED":
-                total_deposits += payment.get("amount", 0)
-            elif payment["type"] == "WITHDRAW" and payment.get("status") == "COMPLETED":
-                total_withdrawals += payment.get("amount", 0)
         
         # Create summary
         summary = {
@@ -573,7 +772,7 @@ class PaymentManager:
             "total_deposits": total_deposits,
             "total_withdrawals": total_withdrawals,
             "net_flow": total_deposits - total_withdrawals,
-            "success_rate": (len([p for p in all_payments if p.get("status") == "COMPLETED"]) / max(total_payments, 1)) * 100
+            "success_rate": (completed_count / max(total_payments, 1)) * 100
         }
         
         return {
@@ -589,27 +788,26 @@ class PaymentManager:
             }
         }
     
-    async def _get_today_withdrawals(self, user_id: int) -> List[Dict]:
-        """Get today's withdrawals for a user"""
-        today = datetime.now().strftime("%Y-%m-%d")
-        withdrawals = []
-        
-        for payment in self.db.payments.values():
-            if (payment.get("user_id") == user_id and 
-                payment.get("type") == "WITHDRAW" and
-                payment.get("requested_at", "").startswith(today)):
-                withdrawals.append(payment)
-        
-        return withdrawals
-    
     def _generate_reference(self) -> str:
         """Generate unique payment reference"""
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        random_part = ''.join(random.choices('ABCDEFGHJKLMNPQRSTUVWXYZ23456789', k=6))
-        return f"MARPD-{timestamp}-{random_part}"
+        random_part = os.urandom(6).translate(_REF_TABLE).decode()
+        return f"MARPD-{self._now_compact()}-{random_part}"
+    
+    def _now_compact(self) -> str:
+        """Current time as YYYYMMDDHHMMSS, formatted at most once per second"""
+        now = int(time.time())
+        cached, cached_sec = self._now_compact_cache
+        if now != cached_sec:
+            cached = datetime.fromtimestamp(now).strftime("%Y%m%d%H%M%S")
+            self._now_compact_cache = (cached, now)
+        return cached
     
     async def get_payment_methods(self) -> List[Dict]:
         """Get available payment methods"""
+        return list(self._public_methods)
+    
+    def _build_public_methods(self) -> List[Dict]:
+        """Build the public payment method list once"""
         methods = []
         
         for code, method in self.payment_methods.items():
@@ -630,51 +828,25 @@ class PaymentManager:
     
     async def get_payment_stats(self, user_id: int = None) -> Dict:
         """Get payment statistics"""
-        total_deposits = 0
-        total_withdrawals = 0
-        pending_deposits = 0
-        pending_withdrawals = 0
-        successful_transactions = 0
-        failed_transactions = 0
-        
-        for payment in self.db.payments.values():
-            if user_id and payment.get("user_id") != user_id:
-                continue
-            
-            amount = payment.get("amount", 0)
-            status = payment.get("status", "PENDING")
-            
-            if payment["type"] == "DEPOSIT":
-                total_deposits += amount
-                if status == "PENDING":
-                    pending_deposits += amount
-            elif payment["type"] == "WITHDRAW":
-                total_withdrawals += amount
-                if status == "PENDING":
-                    pending_withdrawals += amount
-            
-            if status == "COMPLETED":
-                successful_transactions += 1
-            elif status in ["REJECTED", "FAILED"]:
-                failed_transactions += 1
+        stats = self._stats_by_user.get(user_id, Counter()) if user_id else self._stats_global
         
-        total_transactions = len([p for p in self.db.payments.values() 
-                                 if not user_id or p.get("user_id") == user_id])
+        total_deposits = stats["total_deposits"]
+        total_withdrawals = stats["total_withdrawals"]
+        total_transactions = stats["total_transactions"]
+        successful_transactions = stats["successful"]
         
         success_rate = (successful_transactions / max(total_transactions, 1)) * 100
         
         return {
             "total_deposits": total_deposits,
             "total_withdrawals": total_withdrawals,
-            "pending_deposits": pending_deposits,
-            "pending_withdrawals": pending_withdrawals,
+            "pending_deposits": stats["pending_deposits"],
+            "pending_withdrawals": stats["pending_withdrawals"],
             "net_flow": total_deposits - total_withdrawals,
             "total_transactions": total_transactions,
             "successful_transactions": successful_transactions,
-            "failed_transactions": failed_transactions,
+            "failed_transactions": stats["failed"],
             "success_rate": success_rate,
-            "avg_deposit": total_deposits / max(len([p for p in self.db.payments.values() 
-                                                    if p["type"] == "DEPOSIT"]), 1),
-            "avg_withdrawal": total_withdrawals / max(len([p for p in self.db.payments.values() 
-                                                          if p["type"] == "WITHDRAW"]), 1)
-        }
\ No newline at end of file
+            "avg_deposit": total_deposits / max(stats["n_deposits"], 1),
+            "avg_withdrawal": total_withdrawals / max(stats["n_withdrawals"], 1)
+        }
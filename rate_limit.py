@@ -1,53 +1,79 @@
+import gc
+import heapq
+import itertools
 import time
-from collections import defaultdict
+from collections import Counter, OrderedDict, defaultdict, namedtuple
+from functools import lru_cache, wraps
 from typing import Dict, List, Tuple, Optional
 import asyncio
 from datetime import datetime, timedelta
 
+# IP tracking: 1 hour sliding window split into 6 sub-buckets of 10 minutes
+IP_WINDOW = 3600
+IP_BUCKETS = 6
+IP_BUCKET_SPAN = IP_WINDOW // IP_BUCKETS
+
+# Per-type limit settings: window and penalty in seconds
+LimitConfig = namedtuple("LimitConfig", "window max_requests penalty")
+
+# Cap on tracked users/keys before least recently used entries are evicted
+MAX_TRACKED = 100_000
+
+
+class LRUDict(OrderedDict):
+    """OrderedDict that evicts its least recently used entries past maxsize"""
+    
+    def __init__(self, maxsize: int, default_factory=None, on_evict=None):
+        super().__init__()
+        self.maxsize = maxsize
+        self.default_factory = default_factory
+        self.on_evict = on_evict
+        self.evictions = 0
+    
+    def __missing__(self, key):
+        if self.default_factory is None:
+            raise KeyError(key)
+        value = self[key] = self.default_factory()
+        return value
+    
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if len(self) > self.maxsize:
+            old_key, _ = self.popitem(last=False)
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(old_key)
+
+
 class RateLimiter:
     """Advanced Rate Limiting System v15.0.00"""
     
     def __init__(self):
         self.limits = {
-            'user_commands': {
-                'window': 60,  # seconds
-                'max_requests': 30,
-                'penalty': 5  # seconds penalty
-            },
-            'game_requests': {
-                'window': 30,
-                'max_requests': 10,
-                'penalty': 10
-            },
-            'payment_requests': {
-                'window': 300,
-                'max_requests': 5,
-                'penalty': 30
-            },
-            'api_requests': {
-                'window': 60,
-                'max_requests': 60,
-                'penalty': 60
-            },
-            'admin_commands': {
-                'window': 10,
-                'max_requests': 5,
-                'penalty': 2
-            },
-            'spam_protection': {
-                'window': 10,
-                'max_requests': 5,
-                'penalty': 30
-            }
+            'user_commands': LimitConfig(window=60, max_requests=30, penalty=5),
+            'game_requests': LimitConfig(window=30, max_requests=10, penalty=10),
+            'payment_requests': LimitConfig(window=300, max_requests=5, penalty=30),
+            'api_requests': LimitConfig(window=60, max_requests=60, penalty=60),
+            'admin_commands': LimitConfig(window=10, max_requests=5, penalty=2),
+            'spam_protection': LimitConfig(window=10, max_requests=5, penalty=30)
         }
         
-        # Store request history
-        self.request_history = defaultdict(list)
-        self.penalties = defaultdict(dict)
-        self.user_stats = defaultdict(lambda: defaultdict(int))
+        # Token bucket per (user_id, limit_type): [tokens, last_refill]
+        self.buckets: Dict[Tuple[int, str], List[float]] = LRUDict(
+            MAX_TRACKED, on_evict=lambda key: self._unindex_key(self.user_bucket_keys, key)
+        )
+        self.penalties = {}
+        # (user_id, limit_type or None for all types) -> expiry timestamp
+        self.exceptions: Dict[Tuple[int, Optional[str]], float] = {}
+        
+        # Per-user key indexes so user lookups don't scan every key
+        self.user_penalty_keys = defaultdict(set)
+        self.user_bucket_keys = defaultdict(set)
+        self.user_stats = LRUDict(MAX_TRACKED, default_factory=Counter)
         
         # IP-based limiting
-        self.ip_history = defaultdict(list)
+        # (ip, limit_type) -> [count per sub-bucket..., last bucket number]
+        self.ip_history: Dict[Tuple[str, str], List[int]] = {}
         self.suspicious_ips = set()
         
         # Advanced analytics
@@ -59,19 +85,35 @@ class RateLimiter:
             'by_type': defaultdict(int)
         }
         
+        # Running busiest hour (hour, count) and penalty expiry heap
+        self._peak_hour = (0, 0)
+        self._penalty_expiry = []
+        self._penalty_seq = itertools.count()
+        
+        # Per-request counters are batched in [total, by_type, by_hour] and
+        # folded into self.analytics every _flush_every requests
+        self.analytics_enabled = True
+        self._flush_every = 1000
+        self._pending = [0, defaultdict(int), defaultdict(int)]
+        
         print("✅ Advanced Rate Limiter v15.0.00 Initialized")
     
     async def check_limit(self, user_id: int, limit_type: str, 
                          ip_address: str = None) -> Dict:
         """Check if request is allowed"""
         current_time = time.time()
-        window = self.limits[limit_type]['window']
-        max_req = self.limits[limit_type]['max_requests']
+        window, max_req, penalty_duration = self.limits[limit_type]
+        requests_stat, violations_stat = self._stat_names(limit_type)
+        analytics = self.analytics
         
         # Update analytics
-        self.analytics['total_requests'] += 1
-        self.analytics['by_type'][limit_type] += 1
-        self.analytics['peak_hours'][datetime.now().hour] += 1
+        if self.analytics_enabled:
+            pending = self._pending
+            pending[0] += 1
+            pending[1][limit_type] += 1
+            pending[2][time.localtime(current_time).tm_hour] += 1
+            if pending[0] >= self._flush_every:
+                self._flush_analytics()
         
         # Check IP restrictions
         if ip_address:
@@ -83,10 +125,26 @@ class RateLimiter:
                     'reason': 'suspicious_ip'
                 }
         
+        # Users with an active exception bypass the limit
+        key = (user_id, limit_type)
+        exceptions = self.exceptions
+        if exceptions and (current_time < exceptions.get(key, 0)
+                           or current_time < exceptions.get((user_id, None), 0)):
+            return {
+                'allowed': True,
+                'exception': True,
+                'remaining': max_req,
+                'reset_in': 0,
+                'window': window,
+                'limit': max_req,
+                'current': 0
+            }
+        
         # Check if user is in penalty
-        penalty_key = f"{user_id}_{limit_type}"
-        if penalty_key in self.penalties:
-            penalty_end = self.penalties[penalty_key]['until']
+        penalties = self.penalties
+        penalty = penalties.get(key)
+        if penalty is not None:
+            penalty_end = penalty['until']
             if current_time < penalty_end:
                 remaining = penalty_end - current_time
                 return {
@@ -96,60 +154,75 @@ class RateLimiter:
                     'reason': 'penalty_active'
                 }
         
-        # Get user's recent requests
-        history_key = f"{user_id}_{limit_type}"
-        recent_requests = self.request_history[history_key]
+        # Refill the user's token bucket. Everything from here to the return
+        # runs without an await, so concurrent checks on the event loop can't
+        # interleave and over-admit; keep it that way (no await below).
+        buckets = self.buckets
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = [float(max_req), current_time]
+            self.user_bucket_keys[user_id].add(key)
+        else:
+            buckets.move_to_end(key)
+        
+        user_stats = self.user_stats
+        stats = user_stats[user_id]
+        user_stats.move_to_end(user_id)
         
-        # Clean old requests
-        cutoff_time = current_time - window
-        recent_requests = [req_time for req_time in recent_requests if req_time > cutoff_time]
+        tokens = min(max_req, bucket[0] + (current_time - bucket[1]) * max_req / window)
+        bucket[1] = current_time
         
         # Check if limit exceeded
-        if len(recent_requests) >= max_req:
+        if tokens < 1:
+            bucket[0] = tokens
             # Apply penalty
-            penalty_duration = self.limits[limit_type]['penalty']
             penalty_end = current_time + penalty_duration
             
-            self.penalties[penalty_key] = {
+            penalties[key] = {
                 'until': penalty_end,
                 'applied_at': current_time,
-                'violation_count': self.user_stats[user_id].get(f'{limit_type}_violations', 0) + 1
+                'violation_count': stats[violations_stat] + 1
             }
+            self.user_penalty_keys[user_id].add(key)
+            self._push_penalty_expiry(key, penalty_end)
             
             # Update user stats
-            self.user_stats[user_id][f'{limit_type}_violations'] += 1
-            self.analytics['user_violations'][user_id] += 1
-            self.analytics['blocked_requests'] += 1
+            stats[violations_stat] += 1
+            stats['violation_total'] += 1
+            analytics['user_violations'][user_id] += 1
+            analytics['blocked_requests'] += 1
             
             return {
                 'allowed': False,
                 'message': f'রেট লিমিট অতিক্রম করেছেন! {penalty_duration} সেকেন্ডের জন্য ব্লক করা হয়েছে।',
                 'retry_after': penalty_duration,
-                'violations': self.user_stats[user_id][f'{limit_type}_violations'],
+                'violations': stats[violations_stat],
                 'reason': 'limit_exceeded'
             }
         
         # Allow request
-        recent_requests.append(current_time)
-        self.request_history[history_key] = recent_requests[-max_req*2:]  # Keep some extra
+        tokens -= 1
+        bucket[0] = tokens
         
         # Update user stats
-        self.user_stats[user_id]['total_requests'] += 1
-        self.user_stats[user_id][f'{limit_type}_requests'] += 1
-        
-        requests_in_window = len(recent_requests)
-        remaining_requests = max_req - requests_in_window
-        reset_time = window - (current_time - recent_requests[0]) if recent_requests else window
+        stats['total_requests'] += 1
+        stats[requests_stat] += 1
         
         return {
             'allowed': True,
-            'remaining': remaining_requests,
-            'reset_in': int(reset_time),
+            'remaining': int(tokens),
+            'reset_in': int((max_req - tokens) * window / max_req),
             'window': window,
             'limit': max_req,
-            'current': requests_in_window
+            'current': max_req - int(tokens)
         }
     
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _stat_names(limit_type: str) -> Tuple[str, str]:
+        """Per-type user_stats keys, formatted once per limit type"""
+        return f'{limit_type}_requests', f'{limit_type}_violations'
+    
     async def _check_ip_restrictions(self, ip_address: str, limit_type: str) -> bool:
         """Check IP-based restrictions"""
         current_time = time.time()
@@ -159,21 +232,25 @@ class RateLimiter:
             return True
         
         # Track IP requests
-        ip_key = f"{ip_address}_{limit_type}"
-        recent_requests = self.ip_history[ip_key]
-        
-        # Clean old requests
-        cutoff_time = current_time - 3600  # 1 hour window for IP tracking
-        recent_requests = [req_time for req_time in recent_requests if req_time > cutoff_time]
+        ip_key = (ip_address, limit_type)
+        bucket_no = int(current_time // IP_BUCKET_SPAN)
+        counts = self.ip_history.get(ip_key)
+        if counts is None:
+            counts = self.ip_history[ip_key] = [0] * IP_BUCKETS + [bucket_no]
+        
+        # Zero the sub-buckets that slid out of the window since last seen
+        last_no = counts[IP_BUCKETS]
+        for step in range(1, min(bucket_no - last_no, IP_BUCKETS) + 1):
+            counts[(last_no + step) % IP_BUCKETS] = 0
+        counts[IP_BUCKETS] = bucket_no
         
         # Check for suspicious patterns
-        if len(recent_requests) > 100:  # More than 100 requests per hour
+        if sum(counts[:IP_BUCKETS]) > 100:  # More than 100 requests per hour
             self.suspicious_ips.add(ip_address)
             return True
         
         # Update IP history
-        recent_requests.append(current_time)
-        self.ip_history[ip_key] = recent_requests[-200:]  # Keep last 200 requests
+        counts[bucket_no % IP_BUCKETS] += 1
         
         return False
     
@@ -183,21 +260,25 @@ class RateLimiter:
             return
         
         # Get current stats
-        violations = self.user_stats[user_id].get(f'{limit_type}_violations', 0)
-        total_requests = self.user_stats[user_id].get(f'{limit_type}_requests', 0)
+        requests_stat, violations_stat = self._stat_names(limit_type)
+        stats = self.user_stats[user_id]
+        violations = stats[violations_stat]
+        total_requests = stats[requests_stat]
         
         if total_requests > 100:  # Enough data to make adjustments
             violation_rate = violations / total_requests
             
             if violation_rate > 0.3:  # High violation rate
                 # Reduce limit by 20%
-                new_limit = int(self.limits[limit_type]['max_requests'] * 0.8)
-                self.limits[limit_type]['max_requests'] = max(new_limit, 5)
+                limit = self.limits[limit_type]
+                new_limit = int(limit.max_requests * 0.8)
+                self.limits[limit_type] = limit._replace(max_requests=max(new_limit, 5))
             
             elif violation_rate < 0.05 and total_requests > 500:  # Good user
                 # Increase limit by 10%
-                new_limit = int(self.limits[limit_type]['max_requests'] * 1.1)
-                self.limits[limit_type]['max_requests'] = min(new_limit, 100)
+                limit = self.limits[limit_type]
+                new_limit = int(limit.max_requests * 1.1)
+                self.limits[limit_type] = limit._replace(max_requests=min(new_limit, 100))
     
     async def get_user_stats(self, user_id: int) -> Dict:
         """Get user's rate limiting statistics"""
@@ -212,28 +293,48 @@ class RateLimiter:
         active_penalties = 0
         current_time = time.time()
         
-        for penalty_key, penalty_data in self.penalties.items():
-            if f"{user_id}_" in penalty_key and penalty_data['until'] > current_time:
+        for penalty_key in self.user_penalty_keys.get(user_id, ()):
+            if self.penalties[penalty_key]['until'] > current_time:
                 active_penalties += 1
         
+        stats = self.user_stats[user_id]
         return {
-            'total_requests': self.user_stats[user_id].get('total_requests', 0),
-            'violations': sum(1 for k in self.user_stats[user_id].keys() if 'violations' in k),
+            'total_requests': stats['total_requests'],
+            'violations': stats['violation_total'],
             'penalties_active': active_penalties,
             'by_type': {
-                'user_commands': self.user_stats[user_id].get('user_commands_requests', 0),
-                'game_requests': self.user_stats[user_id].get('game_requests_requests', 0),
-                'payment_requests': self.user_stats[user_id].get('payment_requests_requests', 0)
+                'user_commands': stats['user_commands_requests'],
+                'game_requests': stats['game_requests_requests'],
+                'payment_requests': stats['payment_requests_requests']
             },
             'violation_by_type': {
-                'user_commands': self.user_stats[user_id].get('user_commands_violations', 0),
-                'game_requests': self.user_stats[user_id].get('game_requests_violations', 0),
-                'payment_requests': self.user_stats[user_id].get('payment_requests_violations', 0)
+                'user_commands': stats['user_commands_violations'],
+                'game_requests': stats['game_requests_violations'],
+                'payment_requests': stats['payment_requests_violations']
             }
         }
     
+    def _flush_analytics(self):
+        """Fold batched request counters into the analytics totals"""
+        total, by_type, by_hour = self._pending
+        if not total:
+            return
+        analytics = self.analytics
+        analytics['total_requests'] += total
+        for limit_type, count in by_type.items():
+            analytics['by_type'][limit_type] += count
+        peak_hours = analytics['peak_hours']
+        for hour, count in by_hour.items():
+            hour_count = peak_hours[hour] + count
+            peak_hours[hour] = hour_count
+            if hour_count > self._peak_hour[1]:
+                self._peak_hour = (hour, hour_count)
+        self._pending = [0, defaultdict(int), defaultdict(int)]
+    
     async def get_analytics(self) -> Dict:
         """Get rate limiting analytics"""
+        self._flush_analytics()
+        
         # Calculate rates
         total_req = self.analytics['total_requests']
         blocked_req = self.analytics['blocked_requests']
@@ -241,14 +342,14 @@ class RateLimiter:
         block_rate = (blocked_req / max(total_req, 1)) * 100
         
         # Find peak hour
-        peak_hour = max(self.analytics['peak_hours'].items(), key=lambda x: x[1])[0] if self.analytics['peak_hours'] else 0
+        peak_hour = self._peak_hour[0]
         
         # Get top violators
-        top_violators = sorted(
+        top_violators = heapq.nlargest(
+            10,
             self.analytics['user_violations'].items(),
-            key=lambda x: x[1],
-            reverse=True
-        )[:10]
+            key=lambda x: x[1]
+        )
         
         return {
             'total_requests': total_req,
@@ -261,21 +362,24 @@ class RateLimiter:
                 for uid, count in top_violators
             ],
             'suspicious_ips_count': len(self.suspicious_ips),
-            'active_penalties': len([p for p in self.penalties.values() if p['until'] > time.time()])
+            'active_penalties': self._count_active_penalties(time.time()),
+            'active_exceptions': self._count_active_exceptions(time.time())
         }
     
     async def reset_user_limits(self, user_id: int) -> Dict:
         """Reset all limits for a user"""
-        # Remove from request history
-        keys_to_remove = [k for k in self.request_history.keys() if str(user_id) in k]
-        for key in keys_to_remove:
-            del self.request_history[key]
+        # Remove token buckets
+        for key in self.user_bucket_keys.pop(user_id, ()):
+            del self.buckets[key]
         
         # Remove penalties
-        penalties_to_remove = [k for k in self.penalties.keys() if str(user_id) in k]
-        for key in penalties_to_remove:
+        for key in self.user_penalty_keys.pop(user_id, ()):
             del self.penalties[key]
         
+        # Remove exceptions
+        for key in [k for k in self.exceptions if k[0] == user_id]:
+            del self.exceptions[key]
+        
         # Reset user stats
         if user_id in self.user_stats:
             del self.user_stats[user_id]
@@ -295,51 +399,83 @@ class RateLimiter:
         current_time = time.time()
         cutoff_time = current_time - (hours_old * 3600)
         
-        # Clean request history
-        cleaned_count = 0
-        for key, requests in list(self.request_history.items()):
-            # Keep only recent requests
-            recent_requests = [req_time for req_time in requests if req_time > cutoff_time]
-            if recent_requests:
-                self.request_history[key] = recent_requests
-            else:
-                del self.request_history[key]
-                cleaned_count += 1
-        
-        # Clean expired penalties
-        for key, penalty_data in list(self.penalties.items()):
-            if penalty_data['until'] < cutoff_time:
-                del self.penalties[key]
-                cleaned_count += 1
-        
-        # Clean IP history
-        for key, requests in list(self.ip_history.items()):
-            recent_requests = [req_time for req_time in requests if req_time > cutoff_time]
-            if recent_requests:
-                self.ip_history[key] = recent_requests
-            else:
-                del self.ip_history[key]
-                cleaned_count += 1
+        # Bulk deletes drop many refcounts at once; keep the cyclic GC out
+        # of the loop and run one young-generation pass afterwards
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            # Drop idle token buckets (they would be full again anyway)
+            expired = [key for key, bucket in self.buckets.items() if bucket[1] < cutoff_time]
+            for key in expired:
+                self.buckets.pop(key, None)
+                self._unindex_key(self.user_bucket_keys, key)
+            cleaned_count = len(expired)
+            
+            # Clean expired penalties
+            expired = [key for key, data in self.penalties.items() if data['until'] < cutoff_time]
+            for key in expired:
+                self.penalties.pop(key, None)
+                self._unindex_key(self.user_penalty_keys, key)
+            cleaned_count += len(expired)
+            
+            # Clean expired exceptions
+            expired = [key for key, until in self.exceptions.items() if until < cutoff_time]
+            for key in expired:
+                self.exceptions.pop(key, None)
+            cleaned_count += len(expired)
+            
+            # Clean IP history whose newest bucket ended before the cutoff
+            expired = [
+                key for key, counts in self.ip_history.items()
+                if (counts[IP_BUCKETS] + 1) * IP_BUCKET_SPAN <= cutoff_time
+            ]
+            for key in expired:
+                self.ip_history.pop(key, None)
+            cleaned_count += len(expired)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+                gc.collect(0)
         
         print(f"🧹 Rate limiter cleanup: {cleaned_count} items removed")
         return cleaned_count
     
+    def _push_penalty_expiry(self, key: Tuple, until: float):
+        """Track a penalty's expiry so active counts skip expired entries"""
+        heapq.heappush(self._penalty_expiry, (until, next(self._penalty_seq), key))
+    
+    def _count_active_penalties(self, now: float) -> int:
+        """Count unexpired penalties without scanning expired ones"""
+        expiry = self._penalty_expiry
+        while expiry and expiry[0][0] <= now:
+            heapq.heappop(expiry)
+        
+        # Entries whose penalty was removed or replaced are stale
+        active = 0
+        for until, _, key in expiry:
+            penalty = self.penalties.get(key)
+            if penalty is not None and penalty['until'] == until:
+                active += 1
+        return active
+    
+    def _count_active_exceptions(self, now: float) -> int:
+        """Count unexpired exceptions"""
+        return sum(1 for until in self.exceptions.values() if until > now)
+    
+    def _unindex_key(self, index: Dict, key: Tuple):
+        """Remove a (user_id, ...) key from a per-user key index"""
+        keys = index.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[key[0]]
+    
     async def add_exception(self, user_id: int, limit_type: str = None, duration_hours: int = 24):
         """Add exception for specific user"""
-        exception_key = f"ex_{user_id}"
-        
-        if limit_type:
-            exception_key += f"_{limit_type}"
-        
         exception_until = time.time() + (duration_hours * 3600)
         
         # Store exception
-        self.penalties[exception_key] = {
-            'until': exception_until,
-            'type': 'exception',
-            'added_at': time.time(),
-            'duration_hours': duration_hours
-        }
+        self.exceptions[(user_id, limit_type or None)] = exception_until
         
         return {
             'success': True,
@@ -349,13 +485,10 @@ class RateLimiter:
     
     async def remove_exception(self, user_id: int, limit_type: str = None):
         """Remove exception for user"""
-        exception_key = f"ex_{user_id}"
+        exception_key = (user_id, limit_type or None)
         
-        if limit_type:
-            exception_key += f"_{limit_type}"
-        
-        if exception_key in self.penalties:
-            del self.penalties[exception_key]
+        if exception_key in self.exceptions:
+            del self.exceptions[exception_key]
             return {
                 'success': True,
                 'message': f'ইউজার {user_id} এর এক্সেপশন রিমুভ করা হয়েছে।'
@@ -369,19 +502,35 @@ class RateLimiter:
     async def get_limit_config(self) -> Dict:
         """Get current limit configuration"""
         return {
-            'limits': self.limits,
+            'limits': {name: limit._asdict() for name, limit in self.limits.items()},
             'total_users_tracked': len(self.user_stats),
-            'active_penalties': len([p for p in self.penalties.values() if p['until'] > time.time()]),
+            'active_penalties': self._count_active_penalties(time.time()),
             'suspicious_ips': len(self.suspicious_ips),
             'data_size': {
-                'request_history': sum(len(v) for v in self.request_history.values()),
-                'ip_history': sum(len(v) for v in self.ip_history.values()),
+                'buckets': len(self.buckets),
+                'ip_history': len(self.ip_history),
                 'penalties': len(self.penalties),
+                'exceptions': len(self.exceptions),
                 'user_stats': len(self.user_stats)
+            },
+            'evictions': {
+                'buckets': self.buckets.evictions,
+                'user_stats': self.user_stats.evictions
             }
         }
 
 
+# Shared limiter so decorated calls keep their history between calls
+_GLOBAL_LIMITER: Optional[RateLimiter] = None
+
+def _get_limiter() -> RateLimiter:
+    """Get the shared rate limiter, creating it on first use"""
+    global _GLOBAL_LIMITER
+    if _GLOBAL_LIMITER is None:
+        _GLOBAL_LIMITER = RateLimiter()
+    return _GLOBAL_LIMITER
+
+
 # Decorator for easy rate limiting
 def rate_limit(limit_type: str = 'user_commands'):
     """Decorator for rate limiting functions"""
@@ -406,8 +555,7 @@ def rate_limit(limit_type: str = 'user_commands'):
                     ip_address = kwargs['ip_address']
                 
                 if user_id:
-                    # Create rate limiter instance
-                    limiter = RateLimiter()
+                    limiter = _get_limiter()
                     check = await limiter.check_limit(user_id, limit_type, ip_address)
                     
                     if not check['allowed']:
@@ -1,15 +1,104 @@
+import asyncio
+import bisect
+import heapq
+import itertools
 import random
 import json
+import time
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
-from collections import defaultdict
+from typing import Deque, Dict, List, Optional, Tuple
+from collections import Counter, defaultdict, deque, namedtuple
+from functools import lru_cache
 import math
+from logger import Logger
+
+# One pass over a user's games: bet sum/count, games per hour, game times, the games themselves
+GameAggregate = namedtuple("GameAggregate", "bet_total bet_count hour_counts epochs games")
+
+@lru_cache(maxsize=4096)
+def _parse_iso(timestamp: str) -> datetime:
+    """datetime.fromisoformat, memoized for timestamps shared across records"""
+    return datetime.fromisoformat(timestamp)
+
+# Gap between games that starts a new session
+SESSION_GAP_SECONDS = 1800
+
+# Bucket tables for bisect lookups: bucket i covers values below BOUNDS[i]
+_TIME_OF_DAY_BOUNDS = (5, 12, 17, 22)
+_TIME_OF_DAY_LABELS = ('night', 'morning', 'afternoon', 'evening', 'night')
+# Negative day counts (last_active in the future) land in the first 0.7 bucket
+_ACTIVITY_DAY_BOUNDS = (0, 1, 4, 8, 15)
+_ACTIVITY_LEVELS = (0.7, 1.0, 0.7, 0.4, 0.2, 0.1)
+# Frequency buckets are inclusive upper limits (bisect_left)
+_FREQUENCY_LIMITS = (0, 2, 5, 10)
+_FREQUENCY_LABELS = ('none', 'low', 'medium', 'high', 'very_high')
+
+
+# Recommendation message tables and templates
+_GAME_NAMES = {
+    'dice': '🎲 ডাইস গেম',
+    'slot': '🎰 স্লট মেশিন',
+    'quiz': '🧠 কুইজ গেম',
+    'coin_flip': '🪙 কয়েন ফ্লিপ',
+    'number_guess': '🎯 নাম্বার গেস'
+}
+
+_GAME_BEHAVIOR_MESSAGES = {
+    'aggressive': 'আপনার উচ্চ রিস্ক টোলারেন্সের জন্য উপযুক্ত!',
+    'conservative': 'নিরাপদ ও ধারাবাহিক জয়ের সুযোগ!',
+    'balanced': 'রিস্ক ও রিওয়ার্ডের পারফেক্ট ব্যালেন্স!',
+    'explorer': 'নতুন চ্যালেঞ্জের জন্য উত্তম!',
+    'new_user': 'শুরু করার জন্য সহজ গেম!'
+}
+
+_GAME_REC_TMPL = """
+🤖 **AI রিকমেন্ডেশন**
+
+🎮 **গেম:** {game_name}
+📊 **রিস্ক লেভেল:** {risk}
+💰 **রিওয়ার্ড:** {reward}
+⏱️ **সময়:** {time}
+
+💡 **কারণ:** {behavior_msg}
+
+🔥 **বিশেষ সুবিধা:** প্রথম খেলায় ১০% এক্সট্রা এক্সপি!
+        """
+
+_SHOP_BEHAVIOR_MESSAGES = {
+    'aggressive': 'আপনার অ্যাগ্রেসিভ স্টাইলের জন্য পারফেক্ট!',
+    'conservative': 'আপনার কনজারভেটিভ অ্যাপ্রোচের সাথে মিলে যায়!',
+    'balanced': 'আপনার ব্যালেন্সড গেমপ্লের জন্য আদর্শ!',
+    'explorer': 'আপনার এক্সপ্লোরার মেন্টালিটির জন্য উপযুক্ত!',
+    'new_user': 'শুরু করার জন্য উত্তম আইটেম!'
+}
+
+_BENEFIT_LABELS = {
+    'daily_extra': 'প্রতিদিন +{} অতিরিক্ত কয়েন',
+    'xp_boost': '{}% অতিরিক্ত XP',
+    'duration_days': '{} দিনের জন্য',
+    'duration_hours': '{} ঘন্টার জন্য'
+}
+
+_SHOP_REC_TMPL = """
+🛍️ **AI শপ রিকমেন্ডেশন**
+
+{icon} **আইটেম:** {name}
+💰 **দাম:** {price:,} কয়েন
+📝 **বর্ণনা:** {description}
+🏷️ **ক্যাটাগরি:** {category}
+⭐ **দুর্লভতা:** {rarity}
+
+💡 **কারণ:** {behavior_msg}{benefit_text}
+
+🎯 **স্মার্ট টিপ:** এই আইটেম আপনার {behavior} প্লেয়িং স্টাইলের সাথে ৮৫% ম্যাচ করে!
+        """
 
 class AIRecommender:
     """Advanced AI Recommendation System v15.0.00"""
     
     def __init__(self, db):
         self.db = db
+        self.logger = Logger.get_logger(__name__)
         self.user_profiles = {}
         self.game_recommendations = {}
         self.shop_recommendations = {}
@@ -20,6 +109,32 @@ class AIRecommender:
             'popular_items': defaultdict(int)
         }
         
+        # user_id -> (stats key, expiry, profile) for analyze_user_behavior
+        self._profile_cache: Dict[int, Tuple[str, float, Dict]] = {}
+        self.profile_ttl_seconds = 300
+        
+        # Running totals over game_recommendations for the global stats
+        self._game_counts = Counter()
+        self._behavior_success = Counter()
+        self._successful_recs = 0
+        
+        # Sequence for recommendation ids (timestamps collide within a second)
+        self._rec_seq = itertools.count()
+        
+        # (ts, rec_id) pairs in insertion (time) order so cleanup pops from the left
+        self._game_rec_order: Deque[Tuple[float, str]] = deque()
+        self._shop_rec_order: Deque[Tuple[float, str]] = deque()
+        
+        # (last_analyzed_ts, user_id) heap; entries go stale when a profile is re-analyzed
+        self._profile_expiry: List[Tuple[float, int]] = []
+        
+        # user_id -> game and shop recommendation ids, oldest first
+        self._rec_ids_by_user: Dict[int, List[str]] = defaultdict(list)
+        
+        # user_id -> game_history ids, built on first use and kept current by
+        # record_game (register it with GamesManager.add_game_listener)
+        self._games_by_user: Optional[Dict[int, List[str]]] = None
+        
         # Game categories and weights
         self.game_categories = {
             'dice': {'risk': 'low', 'reward': 'medium', 'time': 'short'},
@@ -31,20 +146,73 @@ class AIRecommender:
         
         # User behavior patterns
         self.behavior_patterns = {
-            'aggressive': {'risk_tolerance': 'high', 'preferred_games': ['slot', 'number_guess']},
-            'conservative': {'risk_tolerance': 'low', 'preferred_games': ['dice', 'quiz']},
-            'balanced': {'risk_tolerance': 'medium', 'preferred_games': ['dice', 'slot', 'quiz']},
+            'aggressive': {'risk_tolerance': 'high', 'preferred_games': ('slot', 'number_guess')},
+            'conservative': {'risk_tolerance': 'low', 'preferred_games': ('dice', 'quiz')},
+            'balanced': {'risk_tolerance': 'medium', 'preferred_games': ('dice', 'slot', 'quiz')},
             'explorer': {'risk_tolerance': 'medium', 'preferred_games': 'all'}
         }
         
+        # Periodic cleanup of old recommendations and profiles (see start/stop)
+        self.cleanup_interval_seconds = 3600
+        self.cleanup_days_old = 30
+        self._cleanup_task: Optional[asyncio.Task] = None
+        
+        # Candidate games and draw weights per behavior type
+        self.game_weights = self._build_game_weights()
+        
+        # Shop item category fit per behavior type, and rarity bonus
+        self.category_scores = {
+            'aggressive': {'booster': 0.9, 'charm': 0.7, 'cosmetic': 0.3, 'badge': 0.5},
+            'conservative': {'booster': 0.6, 'charm': 0.8, 'cosmetic': 0.7, 'badge': 0.9},
+            'balanced': {'booster': 0.8, 'charm': 0.8, 'cosmetic': 0.6, 'badge': 0.7},
+            'explorer': {'booster': 0.7, 'charm': 0.6, 'cosmetic': 0.9, 'badge': 0.8}
+        }
+        self.rarity_scores = {'common': 0.1, 'uncommon': 0.3, 'rare': 0.6, 'epic': 0.8, 'legendary': 1.0}
+        
         print("🤖 AI Recommender System v15.0.00 Initialized")
     
+    async def start(self):
+        """Start periodic cleanup on the running event loop"""
+        if self._cleanup_task is None:
+            self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+    
+    async def stop(self):
+        """Stop periodic cleanup"""
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+        self._cleanup_task = None
+    
+    async def _cleanup_loop(self):
+        """Run cleanup_old_data every cleanup interval, off the request path"""
+        while True:
+            await asyncio.sleep(self.cleanup_interval_seconds)
+            try:
+                await self.cleanup_old_data(self.cleanup_days_old)
+            except Exception as e:
+                self.logger.error("AI Recommender cleanup failed: %s", e)
+    
+    def _build_game_weights(self) -> Dict[str, Tuple[Tuple[str, ...], Tuple[float, ...]]]:
+        """Equal draw weights over each behavior's preferred games"""
+        game_weights = {}
+        for behavior, pattern in self.behavior_patterns.items():
+            games = pattern['preferred_games']
+            if games == 'all':
+                games = tuple(self.game_categories)
+            game_weights[behavior] = (games, (1.0,) * len(games))
+        return game_weights
+    
     async def analyze_user_behavior(self, user_id: int) -> Dict:
         """Analyze user behavior and create profile"""
         user = self.db.get_user(user_id)
         if not user:
             return {'behavior': 'unknown', 'confidence': 0}
         
+        # Reuse a recent profile while the user's game count and activity are unchanged
+        cache_key = f"{user.get('total_games')}:{user.get('last_active')}"
+        cached = self._profile_cache.get(user_id)
+        if cached and cached[0] == cache_key and time.monotonic() < cached[1]:
+            return cached[2]
+        
         # Get user game stats
         game_stats = {}
         if 'stats' in user:
@@ -55,19 +223,23 @@ class AIRecommender:
         if total_games < 10:
             return {'behavior': 'new_user', 'confidence': 0.3}
         
+        # Walk the user's games once for every history-based metric
+        aggregate = self._aggregate_user(user_id)
+        
         # Calculate win rate
-        win_rate = await self._calculate_win_rate(user_id)
+        win_rate = self._calculate_win_rate(user)
         
         # Calculate risk appetite
-        risk_appetite = await self._calculate_risk_appetite(user_id)
+        risk_appetite = self._calculate_risk_appetite(user, aggregate)
         
         # Calculate playing patterns
-        playing_patterns = await self._analyze_playing_patterns(user_id)
+        playing_patterns = self._analyze_playing_patterns(aggregate)
         
         # Determine behavior type
         behavior_type = self._determine_behavior_type(win_rate, risk_appetite, playing_patterns)
         
         # Create user profile
+        now = datetime.now()
         user_profile = {
             'user_id': user_id,
             'behavior_type': behavior_type,
@@ -75,23 +247,46 @@ class AIRecommender:
             'risk_appetite': risk_appetite,
             'playing_patterns': playing_patterns,
             'total_games': total_games,
-            'preferred_games': await self._get_preferred_games(user_id),
-            'spending_habits': await self._analyze_spending_habits(user_id),
-            'activity_level': await self._calculate_activity_level(user_id),
-            'last_analyzed': datetime.now().isoformat(),
+            'preferred_games': self._get_preferred_games(user),
+            'spending_habits': self._analyze_spending_habits(user_id, user),
+            'activity_level': self._calculate_activity_level(user),
+            'last_analyzed': now.isoformat(),
+            'last_analyzed_ts': now.timestamp(),
             'profile_version': '2.0',
             'confidence_score': self._calculate_confidence_score(total_games, playing_patterns)
         }
         
         # Store profile
         self.user_profiles[user_id] = user_profile
+        self._push_profile_expiry(user_id, user_profile['last_analyzed_ts'])
+        self._profile_cache[user_id] = (cache_key, time.monotonic() + self.profile_ttl_seconds, user_profile)
         
         return user_profile
     
-    async def _calculate_win_rate(self, user_id: int) -> float:
+    def _aggregate_user(self, user_id: int) -> GameAggregate:
+        """Collect bet and hour aggregates from a single pass over the user's games"""
+        bet_total = 0
+        bet_count = 0
+        hour_counts = Counter()
+        epochs = []
+        games = self._user_games(user_id)
+        
+        for game in games:
+            bet = game.get('bet', 0)
+            if bet > 0:
+                bet_total += bet
+                bet_count += 1
+            
+            epoch = self._game_epoch(game)
+            if epoch is not None:
+                hour_counts[time.localtime(epoch).tm_hour] += 1
+                epochs.append(epoch)
+        
+        return GameAggregate(bet_total, bet_count, hour_counts, epochs, games)
+    
+    def _calculate_win_rate(self, user: Dict) -> float:
         """Calculate user's win rate"""
-        user = self.db.get_user(user_id)
-        if not user or 'stats' not in user:
+        if 'stats' not in user:
             return 0.5  # Default
         
         stats = user['stats']
@@ -108,37 +303,25 @@ class AIRecommender:
         
         return total_won / max(total_played, 1)
     
-    async def _calculate_risk_appetite(self, user_id: int) -> float:
+    def _calculate_risk_appetite(self, user: Dict, aggregate: GameAggregate) -> float:
         """Calculate user's risk appetite (0-1)"""
         # Analyze bet sizes relative to balance
-        user = self.db.get_user(user_id)
-        if not user:
-            return 0.5
-        
         balance = user.get('coins', 0)
         total_games = user.get('total_games', 0)
         
         if total_games < 5 or balance == 0:
             return 0.5
         
-        # Get recent game history
-        recent_bets = []
-        for game_id, game_data in self.db.game_history.items():
-            if game_data.get('user_id') == user_id:
-                bet = game_data.get('bet', 0)
-                if bet > 0:
-                    recent_bets.append(bet)
-        
-        if not recent_bets:
+        if not aggregate.bet_count:
             return 0.5
         
         # Calculate average bet as percentage of balance
-        avg_bet = sum(recent_bets) / len(recent_bets)
+        avg_bet = aggregate.bet_total / aggregate.bet_count
         risk_score = min(avg_bet / max(balance, 1), 1.0)
         
         return risk_score
     
-    async def _analyze_playing_patterns(self, user_id: int) -> Dict:
+    def _analyze_playing_patterns(self, aggregate: GameAggregate) -> Dict:
         """Analyze user's playing patterns"""
         patterns = {
             'preferred_time': None,
@@ -148,35 +331,21 @@ class AIRecommender:
             'streak_behavior': 'normal'
         }
         
-        # Get recent games
-        recent_games = []
-        for game_id, game_data in self.db.game_history.items():
-            if game_data.get('user_id') == user_id:
-                recent_games.append(game_data)
-        
+        recent_games = aggregate.games
         if len(recent_games) < 5:
             return patterns
         
         # Analyze time patterns
-        hour_counts = defaultdict(int)
-        for game in recent_games:
-            timestamp = game.get('timestamp')
-            if timestamp:
-                try:
-                    hour = datetime.fromisoformat(timestamp).hour
-                    hour_counts[hour] += 1
-                except:
-                    pass
-        
+        hour_counts = aggregate.hour_counts
         if hour_counts:
-            preferred_hour = max(hour_counts.items(), key=lambda x: x[1])[0]
+            preferred_hour = hour_counts.most_common(1)[0][0]
             time_of_day = self._categorize_time(preferred_hour)
             patterns['preferred_time'] = time_of_day
         
         # Analyze session behavior
-        sessions = self._group_into_sessions(recent_games)
-        if sessions:
-            avg_session_length = sum(len(s) for s in sessions) / len(sessions)
+        session_count = self._count_sessions(aggregate.epochs)
+        if session_count:
+            avg_session_length = len(aggregate.epochs) / session_count
             patterns['games_per_session'] = avg_session_length
             patterns['session_length'] = avg_session_length * 2  # Assuming 2 minutes per game
         
@@ -184,41 +353,30 @@ class AIRecommender:
     
     def _categorize_time(self, hour: int) -> str:
         """Categorize hour into time of day"""
-        if 5 <= hour < 12:
-            return 'morning'
-        elif 12 <= hour < 17:
-            return 'afternoon'
-        elif 17 <= hour < 22:
-            return 'evening'
-        else:
-            return 'night'
+        return _TIME_OF_DAY_LABELS[bisect.bisect_right(_TIME_OF_DAY_BOUNDS, hour)]
     
-    def _group_into_sessions(self, games: List[Dict]) -> List[List[Dict]]:
-        """Group games into sessions"""
-        if not games:
-            return []
-        
-        # Sort games by timestamp
-        games.sort(key=lambda x: x.get('timestamp', ''))
-        
-        sessions = []
-        current_session = [games[0]]
-        
-        for i in range(1, len(games)):
-            current_time = datetime.fromisoformat(games[i]['timestamp'])
-            prev_time = datetime.fromisoformat(games[i-1]['timestamp'])
-            time_diff = (current_time - prev_time).total_seconds() / 60  # minutes
-            
-            if time_diff < 30:  # Same session if within 30 minutes
-                current_session.append(games[i])
-            else:
-                sessions.append(current_session)
-                current_session = [games[i]]
-        
-        if current_session:
-            sessions.append(current_session)
+    def _game_epoch(self, game: Dict) -> Optional[int]:
+        """Game time in epoch seconds, parsed from 'timestamp' for records without ts_epoch"""
+        epoch = game.get('ts_epoch')
+        if epoch is not None:
+            return epoch
+        
+        # Older records: parse locally, game_history is not ours to rewrite
+        timestamp = game.get('timestamp')
+        if not timestamp:
+            return None
+        try:
+            return int(datetime.fromisoformat(timestamp).timestamp())
+        except ValueError:
+            return None
+    
+    def _count_sessions(self, epochs: List[int]) -> int:
+        """Count play sessions: a new one starts after a SESSION_GAP_SECONDS break"""
+        if not epochs:
+            return 0
         
-        return sessions
+        epochs = sorted(epochs)
+        return 1 + sum(1 for prev, cur in zip(epochs, epochs[1:]) if cur - prev >= SESSION_GAP_SECONDS)
     
     def _determine_behavior_type(self, win_rate: float, risk_appetite: float, patterns: Dict) -> str:
         """Determine user behavior type"""
@@ -231,10 +389,9 @@ class AIRecommender:
         else:
             return 'explorer'
     
-    async def _get_preferred_games(self, user_id: int) -> List[str]:
+    def _get_preferred_games(self, user: Dict) -> List[str]:
         """Get user's preferred games"""
-        user = self.db.get_user(user_id)
-        if not user or 'stats' not in user:
+        if 'stats' not in user:
             return ['dice', 'quiz']  # Default
         
         stats = user['stats']
@@ -252,7 +409,7 @@ class AIRecommender:
         sorted_games = sorted(game_counts.items(), key=lambda x: x[1], reverse=True)
         return [game[0] for game in sorted_games[:3]]
     
-    async def _analyze_spending_habits(self, user_id: int) -> Dict:
+    def _analyze_spending_habits(self, user_id: int, user: Dict) -> Dict:
         """Analyze user's spending habits"""
         habits = {
             'deposit_frequency': 'low',
@@ -283,44 +440,21 @@ class AIRecommender:
             habits['avg_deposit'] = deposit_total / deposit_count
         
         # Analyze shop spending
-        user = self.db.get_user(user_id)
-        if user and 'inventory' in user:
+        if 'inventory' in user:
             habits['shop_spending'] = sum(item.get('price_paid', 0) for item in user['inventory'])
         
         return habits
     
     def _categorize_frequency(self, count: int) -> str:
         """Categorize frequency based on count"""
-        if count == 0:
-            return 'none'
-        elif count <= 2:
-            return 'low'
-        elif count <= 5:
-            return 'medium'
-        elif count <= 10:
-            return 'high'
-        else:
-            return 'very_high'
+        return _FREQUENCY_LABELS[bisect.bisect_left(_FREQUENCY_LIMITS, count)]
     
-    async def _calculate_activity_level(self, user_id: int) -> float:
+    def _calculate_activity_level(self, user: Dict) -> float:
         """Calculate user activity level (0-1)"""
-        user = self.db.get_user(user_id)
-        if not user:
-            return 0
-        
-        last_active = datetime.fromisoformat(user.get('last_active', '2000-01-01'))
+        last_active = _parse_iso(user.get('last_active', '2000-01-01'))
         days_since_active = (datetime.now() - last_active).days
         
-        if days_since_active == 0:
-            return 1.0
-        elif days_since_active <= 3:
-            return 0.7
-        elif days_since_active <= 7:
-            return 0.4
-        elif days_since_active <= 14:
-            return 0.2
-        else:
-            return 0.1
+        return _ACTIVITY_LEVELS[bisect.bisect_right(_ACTIVITY_DAY_BOUNDS, days_since_active)]
     
     def _calculate_confidence_score(self, total_games: int, patterns: Dict) -> float:
         """Calculate confidence score for profile (0-1)"""
@@ -335,53 +469,47 @@ class AIRecommender:
     
     async def recommend_game(self, user_id: int) -> Dict:
         """Recommend a game to user based on profile"""
-        # Get or create user profile
-        if user_id not in self.user_profiles:
-            profile = await self.analyze_user_behavior(user_id)
-        else:
-            profile = self.user_profiles[user_id]
+        # Get user profile (analyze_user_behavior's cache decides freshness)
+        profile = await self.analyze_user_behavior(user_id)
         
         behavior_type = profile['behavior_type']
         confidence = profile['confidence_score']
         
         # Get recommendation based on behavior
         if behavior_type in self.behavior_patterns:
-            pattern = self.behavior_patterns[behavior_type]
-            preferred_games = pattern['preferred_games']
-            
-            if preferred_games == 'all':
-                available_games = list(self.game_categories.keys())
-            else:
-                available_games = preferred_games
+            games, weights = self.game_weights[behavior_type]
             
             # Filter by user's recent games (avoid repetition)
-            recent_games = await self._get_recent_games(user_id, limit=5)
-            recent_game_types = [game.get('game') for game in recent_games if game.get('game')]
-            
-            # Remove recently played games
-            recommended_games = [g for g in available_games if g not in recent_game_types]
+            recent_games = self._get_recent_games(user_id, limit=5)
+            recent_game_types = {game.get('game') for game in recent_games if game.get('game')}
             
-            if not recommended_games:
-                recommended_games = available_games
+            # Zero out recently played games unless nothing else is left
+            fresh_weights = [0.0 if g in recent_game_types else w for g, w in zip(games, weights)]
+            if not any(fresh_weights):
+                fresh_weights = weights
             
             # Select game
-            recommended_game = random.choice(recommended_games)
+            recommended_game = random.choices(games, weights=fresh_weights)[0]
             
             # Create recommendation message
             game_info = self.game_categories.get(recommended_game, {})
             message = self._create_recommendation_message(recommended_game, game_info, behavior_type)
             
-            # Store recommendation
-            rec_id = f"rec_{user_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+            # Store recommendation ('ts' is epoch seconds, formatted only for stats)
+            rec_id = f"rec_{user_id}_{next(self._rec_seq)}"
+            now = time.time()
+            self._rec_ids_by_user[user_id].append(rec_id)
+            self._game_rec_order.append((now, rec_id))
             self.game_recommendations[rec_id] = {
                 'user_id': user_id,
                 'game': recommended_game,
                 'behavior_type': behavior_type,
                 'confidence': confidence,
-                'timestamp': datetime.now().isoformat(),
+                'ts': now,
                 'presented': False,
                 'accepted': False
             }
+            self._track_recommendation(self.game_recommendations[rec_id])
             
             # Update analytics
             self.analytics['total_recommendations'] += 1
@@ -407,51 +535,46 @@ class AIRecommender:
                 'recommendation_id': None
             }
     
-    async def _get_recent_games(self, user_id: int, limit: int = 5) -> List[Dict]:
+    def _get_recent_games(self, user_id: int, limit: int = 5) -> List[Dict]:
         """Get user's recent games"""
-        recent_games = []
-        
-        for game_id, game_data in self.db.game_history.items():
-            if game_data.get('user_id') == user_id:
-                recent_games.append(game_data)
+        # Newest first
+        return heapq.nlargest(limit, self._user_games(user_id), key=lambda x: x.get('timestamp', ''))
+    
+    def record_game(self, game_id: str, game_data: Dict):
+        """Index a game just added to game_history"""
+        if self._games_by_user is None:
+            return  # Index is built from game_history on first use
+        ids = self._games_by_user[game_data.get('user_id')]
+        if not ids or ids[-1] != game_id:
+            ids.append(game_id)
+    
+    def _user_games(self, user_id: int) -> List[Dict]:
+        """Get a user's games from game_history via the per-user index"""
+        history = self.db.game_history
+        if self._games_by_user is None:
+            self._games_by_user = defaultdict(list)
+            for game_id, game_data in history.items():
+                self._games_by_user[game_data.get('user_id')].append(game_id)
+        
+        ids = self._games_by_user.get(user_id)
+        if not ids:
+            return []
         
-        # Sort by timestamp (newest first)
-        recent_games.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-        return recent_games[:limit]
+        games = [history[game_id] for game_id in ids if game_id in history]
+        if len(games) != len(ids):
+            # Drop ids removed from game_history by cleanup
+            ids[:] = [game_id for game_id in ids if game_id in history]
+        return games
     
     def _create_recommendation_message(self, game: str, game_info: Dict, behavior_type: str) -> str:
         """Create personalized recommendation message"""
-        game_names = {
-            'dice': '🎲 ডাইস গেম',
-            'slot': '🎰 স্লট মেশিন',
-            'quiz': '🧠 কুইজ গেম',
-            'coin_flip': '🪙 কয়েন ফ্লিপ',
-            'number_guess': '🎯 নাম্বার গেস'
-        }
-        
-        behavior_messages = {
-            'aggressive': 'আপনার উচ্চ রিস্ক টোলারেন্সের জন্য উপযুক্ত!',
-            'conservative': 'নিরাপদ ও ধারাবাহিক জয়ের সুযোগ!',
-            'balanced': 'রিস্ক ও রিওয়ার্ডের পারফেক্ট ব্যালেন্স!',
-            'explorer': 'নতুন চ্যালেঞ্জের জন্য উত্তম!',
-            'new_user': 'শুরু করার জন্য সহজ গেম!'
-        }
-        
-        game_name = game_names.get(game, game)
-        behavior_msg = behavior_messages.get(behavior_type, 'আপনার প্লেয়িং স্টাইল অনুযায়ী')
-        
-        return f"""
-🤖 **AI রিকমেন্ডেশন**
-
-🎮 **গেম:** {game_name}
-📊 **রিস্ক লেভেল:** {game_info.get('risk', 'Medium').upper()}
-💰 **রিওয়ার্ড:** {game_info.get('reward', 'Medium').upper()}
-⏱️ **সময়:** {game_info.get('time', 'Short')}
-
-💡 **কারণ:** {behavior_msg}
-
-🔥 **বিশেষ সুবিধা:** প্রথম খেলায় ১০% এক্সট্রা এক্সপি!
-        """
+        return _GAME_REC_TMPL.format(
+            game_name=_GAME_NAMES.get(game, game),
+            risk=game_info.get('risk', 'Medium').upper(),
+            reward=game_info.get('reward', 'Medium').upper(),
+            time=game_info.get('time', 'Short'),
+            behavior_msg=_GAME_BEHAVIOR_MESSAGES.get(behavior_type, 'আপনার প্লেয়িং স্টাইল অনুযায়ী')
+        )
     
     async def recommend_shop_item(self, user_id: int) -> Dict:
         """Recommend shop item based on user profile"""
@@ -459,11 +582,8 @@ class AIRecommender:
         if not user:
             return {'success': False, 'message': 'ইউজার খুঁজে পাওয়া যায়নি!'}
         
-        # Get user profile
-        if user_id not in self.user_profiles:
-            profile = await self.analyze_user_behavior(user_id)
-        else:
-            profile = self.user_profiles[user_id]
+        # Get user profile (analyze_user_behavior's cache decides freshness)
+        profile = await self.analyze_user_behavior(user_id)
         
         # Get available shop items
         shop_items = self.db.get_shop_items()
@@ -473,9 +593,10 @@ class AIRecommender:
         
         # Filter items based on user profile
         recommended_items = []
+        owned_ids = {inv_item.get('id') for inv_item in user.get('inventory', [])}
         
         for item in shop_items:
-            score = self._calculate_item_score(item, profile, user)
+            score = self._calculate_item_score(item, profile, user, owned_ids)
             if score > 0.5:  # Minimum score threshold
                 recommended_items.append((item, score))
         
@@ -496,14 +617,17 @@ class AIRecommender:
         message = self._create_shop_recommendation_message(recommended_item, profile)
         
         # Store recommendation
-        rec_id = f"shop_rec_{user_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        rec_id = f"shop_rec_{user_id}_{next(self._rec_seq)}"
+        now = time.time()
+        self._rec_ids_by_user[user_id].append(rec_id)
+        self._shop_rec_order.append((now, rec_id))
         self.shop_recommendations[rec_id] = {
             'user_id': user_id,
             'item_id': recommended_item.get('id'),
             'item_name': recommended_item.get('name'),
             'price': recommended_item.get('price'),
             'score': recommended_items[0][1],
-            'timestamp': datetime.now().isoformat()
+            'ts': now
         }
         
         return {
@@ -515,7 +639,7 @@ class AIRecommender:
             'recommendation_id': rec_id
         }
     
-    def _calculate_item_score(self, item: Dict, profile: Dict, user: Dict) -> float:
+    def _calculate_item_score(self, item: Dict, profile: Dict, user: Dict, owned_ids: set) -> float:
         """Calculate score for shop item (0-1)"""
         score = 0.0
         
@@ -536,18 +660,11 @@ class AIRecommender:
         item_category = item.get('category', '')
         behavior_type = profile.get('behavior_type', '')
         
-        category_scores = {
-            'aggressive': {'booster': 0.9, 'charm': 0.7, 'cosmetic': 0.3, 'badge': 0.5},
-            'conservative': {'booster': 0.6, 'charm': 0.8, 'cosmetic': 0.7, 'badge': 0.9},
-            'balanced': {'booster': 0.8, 'charm': 0.8, 'cosmetic': 0.6, 'badge': 0.7},
-            'explorer': {'booster': 0.7, 'charm': 0.6, 'cosmetic': 0.9, 'badge': 0.8}
-        }
-        
-        category_score = category_scores.get(behavior_type, {}).get(item_category, 0.5)
+        category_score = self.category_scores.get(behavior_type, {}).get(item_category, 0.5)
         score += category_score * 0.3
         
         # User needs (20% weight)
-        user_needs_score = self._calculate_user_needs_score(item, user, profile)
+        user_needs_score = self._calculate_user_needs_score(item, owned_ids, profile)
         score += user_needs_score * 0.2
         
         # Popularity (10% weight)
@@ -556,21 +673,18 @@ class AIRecommender:
         
         # Rarity bonus (10% weight)
         rarity = item.get('rarity', 'common')
-        rarity_scores = {'common': 0.1, 'uncommon': 0.3, 'rare': 0.6, 'epic': 0.8, 'legendary': 1.0}
-        rarity_score = rarity_scores.get(rarity, 0.5)
+        rarity_score = self.rarity_scores.get(rarity, 0.5)
         score += rarity_score * 0.1
         
         return min(score, 1.0)
     
-    def _calculate_user_needs_score(self, item: Dict, user: Dict, profile: Dict) -> float:
+    def _calculate_user_needs_score(self, item: Dict, owned_ids: set, profile: Dict) -> float:
         """Calculate score based on user's needs"""
         score = 0.0
         
         # Check if user already has the item
-        inventory = user.get('inventory', [])
-        for inv_item in inventory:
-            if inv_item.get('id') == item.get('id'):
-                return 0.0  # Already have it
+        if item.get('id') in owned_ids:
+            return 0.0  # Already have it
         
         # Analyze user's weaknesses
         win_rate = profile.get('win_rate', 0.5)
@@ -596,69 +710,75 @@ class AIRecommender:
     
     def _create_shop_recommendation_message(self, item: Dict, profile: Dict) -> str:
         """Create shop recommendation message"""
-        behavior_messages = {
-            'aggressive': 'আপনার অ্যাগ্রেসিভ স্টাইলের জন্য পারফেক্ট!',
-            'conservative': 'আপনার কনজারভেটিভ অ্যাপ্রোচের সাথে মিলে যায়!',
-            'balanced': 'আপনার ব্যালেন্সড গেমপ্লের জন্য আদর্শ!',
-            'explorer': 'আপনার এক্সপ্লোরার মেন্টালিটির জন্য উপযুক্ত!',
-            'new_user': 'শুরু করার জন্য উত্তম আইটেম!'
-        }
-        
         behavior = profile.get('behavior_type', 'balanced')
-        behavior_msg = behavior_messages.get(behavior, 'আপনার গেমিং স্টাইলের জন্য')
         
-        benefits = item.get('bonus', {})
         benefit_text = ""
-        
-        if benefits:
-            benefit_list = []
-            for key, value in benefits.items():
-                if key == 'daily_extra':
-                    benefit_list.append(f'প্রতিদিন +{value} অতিরিক্ত কয়েন')
-                elif key == 'xp_boost':
-                    benefit_list.append(f'{value}% অতিরিক্ত XP')
-                elif key == 'duration_days':
-                    benefit_list.append(f'{value} দিনের জন্য')
-                elif key == 'duration_hours':
-                    benefit_list.append(f'{value} ঘন্টার জন্য')
-            
-            if benefit_list:
-                benefit_text = "\n✨ **বিশেষ সুবিধা:**\n" + "\n".join([f"• {b}" for b in benefit_list])
-        
-        return f"""
-🛍️ **AI শপ রিকমেন্ডেশন**
-
-{item.get('icon', '🎁')} **আইটেম:** {item.get('name', 'Unknown')}
-💰 **দাম:** {item.get('price', 0):,} কয়েন
-📝 **বর্ণনা:** {item.get('description', '')}
-🏷️ **ক্যাটাগরি:** {item.get('category', 'general').upper()}
-⭐ **দুর্লভতা:** {item.get('rarity', 'common').upper()}
-
-💡 **কারণ:** {behavior_msg}{benefit_text}
-
-🎯 **স্মার্ট টিপ:** এই আইটেম আপনার {behavior} প্লেয়িং স্টাইলের সাথে ৮৫% ম্যাচ করে!
-        """
+        benefit_list = [
+            _BENEFIT_LABELS[key].format(value)
+            for key, value in (item.get('bonus') or {}).items()
+            if key in _BENEFIT_LABELS
+        ]
+        if benefit_list:
+            benefit_text = "\n✨ **বিশেষ সুবিধা:**\n" + "\n".join([f"• {b}" for b in benefit_list])
+        
+        return _SHOP_REC_TMPL.format(
+            icon=item.get('icon', '🎁'),
+            name=item.get('name', 'Unknown'),
+            price=item.get('price', 0),
+            description=item.get('description', ''),
+            category=item.get('category', 'general').upper(),
+            rarity=item.get('rarity', 'common').upper(),
+            behavior_msg=_SHOP_BEHAVIOR_MESSAGES.get(behavior, 'আপনার গেমিং স্টাইলের জন্য'),
+            benefit_text=benefit_text,
+            behavior=behavior
+        )
     
     async def track_recommendation_feedback(self, recommendation_id: str, accepted: bool):
         """Track user feedback on recommendations"""
         if recommendation_id.startswith('rec_') and recommendation_id in self.game_recommendations:
-            self.game_recommendations[recommendation_id]['accepted'] = accepted
-            self.game_recommendations[recommendation_id]['presented'] = True
+            rec = self.game_recommendations[recommendation_id]
+            self._track_recommendation(rec, -1)
+            rec['accepted'] = accepted
+            rec['presented'] = True
+            self._track_recommendation(rec)
             
             if accepted:
                 self.analytics['successful_recommendations'] += 1
+                # Only an accepted game the profile doesn't already prefer
+                # changes it; dropping the cache entry makes the next
+                # recommend_* call rebuild it via analyze_user_behavior
+                profile = self.user_profiles.get(rec['user_id'])
+                if profile and rec['game'] not in profile.get('preferred_games', ()):
+                    self._profile_cache.pop(rec['user_id'], None)
         
         elif recommendation_id.startswith('shop_rec_') and recommendation_id in self.shop_recommendations:
             item_id = self.shop_recommendations[recommendation_id].get('item_id')
             if item_id and accepted:
                 self.analytics['popular_items'][item_id] += 1
     
+    def _track_recommendation(self, rec: Dict, sign: int = 1):
+        """Add (sign=1) or remove (sign=-1) a game recommendation from the running totals"""
+        self._bump_count(self._game_counts, rec.get('game'), sign)
+        if rec.get('accepted', False):
+            self._successful_recs += sign
+            self._bump_count(self._behavior_success, rec.get('behavior_type'), sign)
+    
+    @staticmethod
+    def _bump_count(counter: Counter, key, sign: int):
+        """Adjust a counter, dropping keys that fall to zero"""
+        count = counter[key] + sign
+        if count > 0:
+            counter[key] = count
+        else:
+            counter.pop(key, None)
+    
     async def get_recommendation_stats(self, user_id: int = None) -> Dict:
         """Get recommendation statistics"""
         if user_id:
             # User-specific stats
-            user_recs = [r for r in self.game_recommendations.values() if r['user_id'] == user_id]
-            shop_recs = [r for r in self.shop_recommendations.values() if r['user_id'] == user_id]
+            rec_ids = self._rec_ids_by_user.get(user_id, ())
+            user_recs = [self.game_recommendations[i] for i in rec_ids if i in self.game_recommendations]
+            shop_recs = [self.shop_recommendations[i] for i in rec_ids if i in self.shop_recommendations]
             
             accepted_count = sum(1 for r in user_recs if r.get('accepted', False))
             presented_count = sum(1 for r in user_recs if r.get('presented', False))
@@ -672,30 +792,25 @@ class AIRecommender:
                 'shop_recommendations': len(shop_recs),
                 'accepted_count': accepted_count,
                 'acceptance_rate': f"{acceptance_rate:.1f}%",
-                'last_recommendation': user_recs[-1]['timestamp'] if user_recs else None,
+                'last_recommendation': datetime.fromtimestamp(user_recs[-1]['ts']).isoformat() if user_recs else None,
                 'profile': self.user_profiles.get(user_id, {})
             }
         else:
             # Global stats
             total_recs = len(self.game_recommendations) + len(self.shop_recommendations)
-            successful_recs = sum(1 for r in self.game_recommendations.values() if r.get('accepted', False))
+            successful_recs = self._successful_recs
             
             success_rate = (successful_recs / max(len(self.game_recommendations), 1)) * 100
             
             # Most recommended games
-            game_counts = defaultdict(int)
-            for rec in self.game_recommendations.values():
-                game_counts[rec.get('game')] += 1
+            game_counts = self._game_counts
             
-            most_recommended_game = max(game_counts.items(), key=lambda x: x[1])[0] if game_counts else 'None'
+            most_recommended_game = game_counts.most_common(1)[0][0] if game_counts else 'None'
             
             # Most successful behavior type
-            behavior_success = defaultdict(int)
-            for rec in self.game_recommendations.values():
-                if rec.get('accepted', False):
-                    behavior_success[rec.get('behavior_type')] += 1
+            behavior_success = self._behavior_success
             
-            most_successful_behavior = max(behavior_success.items(), key=lambda x: x[1])[0] if behavior_success else 'None'
+            most_successful_behavior = behavior_success.most_common(1)[0][0] if behavior_success else 'None'
             
             return {
                 'total_recommendations': total_recs,
@@ -732,56 +847,101 @@ class AIRecommender:
         for behavior, games in successful_games_by_behavior.items():
             if games and behavior in self.behavior_patterns:
                 # Find most successful game for this behavior
-                from collections import Counter
                 game_counts = Counter(games)
                 most_successful = game_counts.most_common(1)[0][0]
                 
                 # Update preferred games
                 if most_successful not in self.behavior_patterns[behavior]['preferred_games']:
                     print(f"📊 Updated {behavior} pattern: Added {most_successful} to preferred games")
-                    if isinstance(self.behavior_patterns[behavior]['preferred_games'], list):
-                        self.behavior_patterns[behavior]['preferred_games'].append(most_successful)
+                    if isinstance(self.behavior_patterns[behavior]['preferred_games'], tuple):
+                        self.behavior_patterns[behavior]['preferred_games'] += (most_successful,)
+                        games, weights = self.game_weights[behavior]
+                        self.game_weights[behavior] = (games + (most_successful,), weights + (1.0,))
         
         print("✅ Recommendation algorithms improved!")
     
+    def _pop_older(self, order: Deque[Tuple[float, str]], cutoff_ts: float) -> List[str]:
+        """Remove and return rec ids stamped before cutoff_ts from the front of an order deque"""
+        # Appends are in time.time() order, so the first entry at or past the
+        # cutoff ends the scan. If the clock steps back, a late entry only waits
+        # until the entries ahead of it expire.
+        old_ids = []
+        while order and order[0][0] < cutoff_ts:
+            old_ids.append(order.popleft()[1])
+        return old_ids
+    
+    def _push_profile_expiry(self, user_id: int, ts: float):
+        """Track a profile's analysis time, compacting stale heap entries now and then"""
+        heapq.heappush(self._profile_expiry, (ts, user_id))
+        if len(self._profile_expiry) > 2 * len(self.user_profiles) + 64:
+            self._profile_expiry = [(self._profile_ts(p), uid) for uid, p in self.user_profiles.items()]
+            heapq.heapify(self._profile_expiry)
+    
+    def _profile_ts(self, profile: Dict) -> float:
+        """Epoch seconds of a profile's last analysis, backfilled for older profiles"""
+        ts = profile.get('last_analyzed_ts')
+        if ts is None:
+            ts = _parse_iso(profile.get('last_analyzed', '2000-01-01')).timestamp()
+            profile['last_analyzed_ts'] = ts
+        return ts
+    
     async def cleanup_old_data(self, days_old: int = 30):
         """Cleanup old recommendation data"""
         cutoff_date = datetime.now() - timedelta(days=days_old)
-        cutoff_str = cutoff_date.isoformat()
+        cutoff_ts = cutoff_date.timestamp()
         
         # Clean game recommendations
-        old_game_recs = [
-            rid for rid, rec in self.game_recommendations.items()
-            if rec['timestamp'] < cutoff_str
-        ]
+        old_game_recs = self._pop_older(self._game_rec_order, cutoff_ts)
         
+        stale_users = set()
         for rid in old_game_recs:
-            del self.game_recommendations[rid]
+            rec = self.game_recommendations.pop(rid)
+            self._track_recommendation(rec, -1)
+            stale_users.add(rec['user_id'])
         
         # Clean shop recommendations
-        old_shop_recs = [
-            rid for rid, rec in self.shop_recommendations.items()
-            if rec['timestamp'] < cutoff_str
-        ]
+        old_shop_recs = self._pop_older(self._shop_rec_order, cutoff_ts)
         
         for rid in old_shop_recs:
-            del self.shop_recommendations[rid]
+            stale_users.add(self.shop_recommendations.pop(rid)['user_id'])
+        
+        # Drop removed ids from the per-user index
+        for user_id in stale_users:
+            rec_ids = [
+                rid for rid in self._rec_ids_by_user.get(user_id, ())
+                if rid in self.game_recommendations or rid in self.shop_recommendations
+            ]
+            if rec_ids:
+                self._rec_ids_by_user[user_id] = rec_ids
+            else:
+                self._rec_ids_by_user.pop(user_id, None)
         
         # Clean old user profiles (inactive users)
-        inactive_users = []
-        for user_id, profile in self.user_profiles.items():
-            last_analyzed = datetime.fromisoformat(profile.get('last_analyzed', '2000-01-01'))
-            if last_analyzed < cutoff_date:
-                # Check if user is active
-                user = self.db.get_user(user_id)
-                if user:
-                    last_active = datetime.fromisoformat(user.get('last_active', '2000-01-01'))
-                    if last_active < cutoff_date:
-                        inactive_users.append(user_id)
+        heap = self._profile_expiry
+        stale_profiles = []
+        while heap and heap[0][0] < cutoff_ts:
+            ts, user_id = heapq.heappop(heap)
+            profile = self.user_profiles.get(user_id)
+            if profile is not None and profile.get('last_analyzed_ts') == ts:
+                stale_profiles.append(user_id)
+        
+        # Check if those users are still active with one user fetch
+        users = self.db.get_users_bulk(stale_profiles) if stale_profiles else {}
+        inactive_users = [
+            user_id for user_id, user in users.items()
+            if _parse_iso(user.get('last_active', '2000-01-01')) < cutoff_date
+        ]
         
         for user_id in inactive_users:
             del self.user_profiles[user_id]
+            self._profile_cache.pop(user_id, None)
+        
+        # Old profiles of users still active are checked again next sweep
+        removed = set(inactive_users)
+        for user_id in stale_profiles:
+            if user_id not in removed:
+                heapq.heappush(heap, (self.user_profiles[user_id]['last_analyzed_ts'], user_id))
         
         cleaned_count = len(old_game_recs) + len(old_shop_recs) + len(inactive_users)
-        print(f"🧹 AI Recommender cleanup: {cleaned_count} items removed")
+        self.logger.info("AI Recommender cleanup: %d items removed", cleaned_count)
         return cleaned_count
\ No newline at end of file